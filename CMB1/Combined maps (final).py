@@ -1,73 +1,48 @@
-import numpy as np
 import healpy as hp
 import matplotlib.pyplot as plt
 from astropy.io import fits
-from astropy.coordinates import SkyCoord
-import astropy.units as u
+from mapmaking import make_maps
 
-# --- HEALPix Setup ---
-nside = 128
-npix = hp.nside2npix(nside)
-combined_map = np.zeros(npix)
-hit_count = np.zeros(npix)
 
-all_l = []
-all_b = []
+def main():
+    # --- HEALPix Setup ---
+    nside = 128
+    ndays = 9
 
-# --- Loop over 9 days ---
-for day in range(9):
-    print(f"Processing day {day}...")
+    # --- Bin the days in parallel ---
+    # TOD and pointings are read memory-mapped, by chunks of samples, into running sum / hit maps
+    # (one per day, in a process pool), which are then merged into the combined map
+    print(f"Processing days 0-{ndays - 1}...")
+    combined, day_maps = make_maps(range(ndays), nside=nside)
 
-    # Load TOD
-    with fits.open(f"TOD/TOD_day{day}.fits") as hdul_tod:
-        tod = hdul_tod[0].data
+    # Per-day hit counts come out of the same run
+    for day, day_map in day_maps.items():
+        fits.PrimaryHDU(day_map.hits).writeto(f"hit_count_day{day}.fits", overwrite=True)
 
-    # Load pointings
-    with fits.open(f"Pointings/pointing_day{day}.fits") as hdul_point:
-        point_array = hdul_point[0].data
+    # --- Normalize final map ---
+    final_map = combined.map()
+    hit_count = combined.hits
 
-    # Extract Galactic coordinates
-    b = point_array[5]  # Galactic latitude
-    l = point_array[6]  # Galactic longitude
+    # Save hit count for reference
+    hdu = fits.PrimaryHDU(hit_count)
+    hdu.writeto("hit_count_combined.fits", overwrite=True)
 
-    all_l.append(l)
-    all_b.append(b)
+    # --- Mean Galactic center for plot (running mean over all samples) ---
+    mean_l, mean_b = combined.center()
 
-    # Convert to HEALPix angles
-    sky_coords = SkyCoord(l=l * u.deg, b=b * u.deg, frame="galactic")
-    theta = np.pi / 2 - sky_coords.b.radian
-    phi = sky_coords.l.radian
+    # --- Plot ---
+    hp.gnomview(final_map,
+                rot=[mean_l, mean_b, 0],  # Centered on average galactic coords
+                coord='G',
+                reso=30,
+                min=-200,
+                max=200,
+                title=f"Combined Galactic Map (Days 0–{ndays - 1})")
 
-    pixel_indices = hp.ang2pix(nside, theta, phi)
+    hp.graticule()
+    plt.show()
 
-    # Accumulate TOD values and hit counts
-    for i, pix in enumerate(pixel_indices):
-        combined_map[pix] += tod[i]
-        hit_count[pix] += 1
 
-# --- Normalize final map ---
-final_map = np.full(npix, hp.UNSEEN)
-valid = hit_count > 0
-final_map[valid] = combined_map[valid] / hit_count[valid]
-
-# Save hit count for reference
-hdu = fits.PrimaryHDU(hit_count)
-hdu.writeto("hit_count_combined.fits", overwrite=True)
-
-# --- Compute mean Galactic center for plot ---
-all_l = np.concatenate(all_l)
-all_b = np.concatenate(all_b)
-mean_l = np.mean(all_l)
-mean_b = np.mean(all_b)
-
-# --- Plot ---
-hp.gnomview(final_map,
-            rot=[mean_l, mean_b, 0],  # Centered on average galactic coords
-            coord='G',
-            reso=30,
-            min=-200,
-            max=200,
-            title="Combined Galactic Map (Days 0–8)")
-
-hp.graticule()
-plt.show()
+# The day pool re-imports this script in its workers (spawn start method): run only as a script
+if __name__ == "__main__":
+    main()
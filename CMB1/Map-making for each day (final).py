@@ -2,14 +2,10 @@ import numpy as np
 import healpy as hp
 import matplotlib.pyplot as plt
 from astropy.io import fits
-from astropy.coordinates import SkyCoord
-import astropy.units as u
+from mapmaking import PointingMatrix
 
 # --- HEALPix Setup ---
 nside = 128
-npix = hp.nside2npix(nside)
-day_map = np.zeros(npix)
-hit_count = np.zeros(npix)
 
 day = 0
 print(f"Processing day {day}...")
@@ -27,22 +23,14 @@ dec = point_array[4]                 # Declination (unused for this version)
 b = point_array[5]                   # Galactic latitude
 l = point_array[6]                   # Galactic longitude
 
-# --- Convert to HEALPix angles using Galactic coordinates ---
-sky_coords = SkyCoord(l=l * u.deg, b=b * u.deg, frame="galactic")
-theta = np.pi / 2 - sky_coords.b.radian  # co-latitude
-phi = sky_coords.l.radian                # longitude
-
-pixel_indices = hp.ang2pix(nside, theta, phi)
+# --- Pointing matrix of the day (pixel index file built once per pointing file) ---
+pointing = PointingMatrix.from_pointing_file(f"Pointings/pointing_day{day}.fits", nside)
 
 # --- Fill map and hit count ---
-for i, pix in enumerate(pixel_indices):
-    day_map[pix] += tod[i]
-    hit_count[pix] += 1
+hit_count = pointing.hits
 
 # --- Normalize ---
-final_map = np.full(npix, hp.UNSEEN)
-valid = hit_count > 0
-final_map[valid] = day_map[valid] / hit_count[valid]
+final_map = pointing.map(tod)
 hdu = fits.PrimaryHDU(hit_count)
 hdu.writeto("hit_count_day"+str(day)+".fits", overwrite=True)
 
@@ -1,48 +1,32 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from astropy.io import fits
-from scipy.optimize import curve_fit
+from noise import estimate_noise
 
-# --- Load signal from FITS file ---
+# --- Signal FITS file (read memory-mapped, by chunks) ---
 filename = 'TOD_day0.fits'
 
-with fits.open(filename) as hdul:
-    data = hdul[0].data
-    signal = data.flatten()
-
 # --- Sampling rate in Hz ---
 fs = 1000.0  # <-- Replace with actual value
 
-# --- Compute FFT ---
-N = len(signal)
-freqs = np.fft.rfftfreq(N, d=1/fs)
-fft_vals = np.fft.rfft(signal)
-magnitude = np.abs(fft_vals)
-
-
-# --- Remove f=0 to avoid division by zero in model ---
-freqs = freqs[1:]
-magnitude = magnitude[1:]
-
-# --- Fit model: sqrt(a + b/f) to magnitude spectrum ---
-def model(f, a, b):
-    return np.sqrt(a + b / f)
+# --- Welch spectrum (averaged periodograms of overlapping segments), log-binned, and fit of a + b/f ---
+noise, errors, (freqs, psd, sigma) = estimate_noise(filename, fs=fs)
+fitted_psd = noise.psd(freqs)
+quotient = psd / fitted_psd
 
-popt, _ = curve_fit(model, freqs, magnitude, p0=(1, 1))
-fitted_magnitude = model(freqs, *popt)
-quotient = magnitude / fitted_magnitude
 # --- Plot ---
 plt.figure(figsize=(10, 5))
-plt.plot(np.log10(freqs), magnitude, label='|FFT(signal)|', color='blue')
-plt.plot(np.log10(freqs), fitted_magnitude, label='Fit: √(a + b/f)', color='red', linestyle='--')
-plt.plot(np.log10(freqs), quotient*1e6, label='quotient', color="green")
+plt.errorbar(np.log10(freqs), psd, yerr=sigma, fmt='o', label='Welch PSD (log-binned)', color='blue')
+plt.plot(np.log10(freqs), fitted_psd, label='Fit: a + b/f', color='red', linestyle='--')
+plt.plot(np.log10(freqs), quotient * np.median(psd), label='quotient (× median PSD)', color="green")
+plt.yscale('log')
 plt.xlabel('log₁₀(Frequency [Hz])')
-plt.ylabel('Magnitude')
-plt.title('FFT Magnitude and √(a + b/f) Fit')
+plt.ylabel('PSD')
+plt.title('Noise power spectrum and a + b/f fit')
 plt.legend()
 plt.grid(True)
 plt.tight_layout()
 plt.show()
 
 # --- Print fitted parameters ---
-print(f"Fitted parameters:\n  a = {popt[0]:.4e}\n  b = {popt[1]:.4e}")
+print(f"Fitted parameters:\n  a = {noise.a:.4e} ± {errors[0]:.1e}\n  b = {noise.b:.4e} ± {errors[1]:.1e}"
+      f"\n  f_knee = {noise.fknee():.3f} Hz")
@@ -1,7 +1,14 @@
+# Prewhitened (quotient) TOD of TOD_day0.fits, read from the current directory.
+# Uses the shared noise estimator CMB1/noise.py, so CMB1 must be importable. From this directory:
+#     PYTHONPATH=.. python Prewhitening.py
 import numpy as np
 from astropy.io import fits
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+try:
+    from noise import estimate_noise
+except ImportError as error:
+    raise ImportError("Prewhitening.py needs CMB1/noise.py: run it as 'PYTHONPATH=.. python Prewhitening.py' "
+                      "from CMB1/Prewhitening") from error
 
 def robust_quotient_tod(signal, fs=1000.0):
     """Compute properly scaled quotient TOD"""
@@ -16,12 +23,11 @@ def robust_quotient_tod(signal, fs=1000.0):
     working_fft = fft_vals[1:]
     magnitudes = np.abs(working_fft)
     
-    # Fit noise model
+    # Fit noise model N(f) = a + b/f on the log-binned Welch spectrum (only b/a matters below)
+    noise, _, _ = estimate_noise(signal, fs=fs, nperseg=min(2**16, N))
+    a, b = noise.a, noise.b
     def model(f, a, b):
         return np.sqrt(a + b/f)
-    
-    popt, _ = curve_fit(model, working_freqs, magnitudes, p0=(1, 1), maxfev=5000)
-    a, b = popt
     fitted = model(working_freqs, a, b)
     
     # PROPER SCALING APPLIED HERE
@@ -49,7 +55,8 @@ with fits.open('TOD_day0.fits') as hdul:
 
 # Compute properly scaled quotient TOD
 quotient_tod, a, b = robust_quotient_tod(signal)
-print(f"Fit parameters: a={a:.3e}, b={b:.3e}")
+# a, b in per-sample PSD units (white noise of variance sigma^2 has a = sigma^2), see noise.py
+print(f"Fit parameters: a={a:.3e}, b={b:.3e} (PSD units), knee frequency b/a={b / a:.3f} Hz")
 
 # Verify results
 plt.figure(figsize=(12,4))
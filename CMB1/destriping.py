@@ -0,0 +1,173 @@
+import numpy as np
+from mapmaking import normalize_map
+from noise import estimate_noise
+
+# --- Iterative map-making with the 1/f noise model ---
+# Both map-makers solve their normal equations with preconditioned conjugate gradients,
+# the noise model N(f) = a + b/f (as fitted by robust_quotient_tod) being applied in Fourier
+# space, one day at a time (circulant approximation of the noise covariance of a day).
+#   gls_map:  (sum P^T N^-1 P) m = sum P^T N^-1 d on the observed pixels,
+#             preconditioned by the diagonal of P^T N^-1 P.
+#   destripe: TOD = P m + F x + white noise, with baselines x of baseline_length samples and the
+#             1/f part of N(f) as their prior; preconditioned block by block (one per baseline).
+# The overall normalisation of a and b cancels: only the knee frequency b/a matters.
+# OneOverFNoise (noise.py) holds the model, e.g. as fitted by noise.estimate_noise.
+
+
+def apply_filter(tod, inverse):
+    """Circulant filtering of a TOD by its rfft-domain filter (N^-1 d)."""
+    return np.fft.irfft(np.fft.rfft(tod) * inverse, n=len(tod))
+
+
+def pcg(apply_A, b, apply_M, x0=None, tol=1e-6, maxiter=200):
+    """
+    Preconditioned conjugate gradients for A x = b (A symmetric positive (semi-)definite).
+
+    Args:
+        apply_A, apply_M (function): products by A and by the preconditioner M ~ A^-1.
+        tol (float): stops when |r| / |b| < tol.
+
+    Returns:
+        x, residuals: solution and relative residual norm at every iteration.
+    """
+    x = np.zeros_like(b) if x0 is None else x0.copy()
+    r = b - apply_A(x)
+    z = apply_M(r)
+    p = z.copy()
+    rz = r @ z
+    bnorm = np.linalg.norm(b)
+    if bnorm == 0:
+        return x, [0.]
+    residuals = [np.linalg.norm(r) / bnorm]
+    for i in range(maxiter):
+        if residuals[-1] < tol:
+            break
+        Ap = apply_A(p)
+        alpha = rz / (p @ Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        residuals.append(np.linalg.norm(r) / bnorm)
+        z = apply_M(r)
+        rz, rz_old = r @ z, rz
+        p = z + (rz / rz_old) * p
+    return x, residuals
+
+
+def _common_pixels(pointings):
+    ### pointing matrices of all days restricted to the pixels observed on any day
+    observed = np.unique(np.concatenate([p.observed() for p in pointings]))
+    return [p.compress(observed)[0] for p in pointings], observed
+
+
+def _per_day(noise, ndays):
+    return list(noise) if isinstance(noise, (list, tuple)) else [noise] * ndays
+
+
+def gls_map(pointings, tods, noise, tol=1e-6, maxiter=200):
+    """
+    Generalized least-squares map of several days.
+
+    Args:
+        pointings (list): PointingMatrix of every day (without weights).
+        tods (list): TOD of every day.
+        noise (OneOverFNoise or list): noise model (of every day).
+
+    Returns:
+        final_map, residuals: full-sky map (hp.UNSEEN where not observed) and PCG residuals.
+    """
+    local, observed = _common_pixels(pointings)
+    inverses = [n.inverse_filter(len(tod)) for n, tod in zip(_per_day(noise, len(tods)), tods)]
+
+    def apply_A(m):
+        return sum(P.bin(apply_filter(P.project(m), inv)) for P, inv in zip(local, inverses))
+
+    ### diagonal of P^T N^-1 P: hits times the diagonal of the circulant N^-1
+    diagonal = sum(P.hits * np.fft.irfft(inv, n=len(P))[0] for P, inv in zip(local, inverses))
+    rhs = sum(P.bin(apply_filter(np.asarray(tod, dtype=float), inv)) for P, tod, inv in zip(local, tods, inverses))
+    m, residuals = pcg(apply_A, rhs, lambda r: r / diagonal, tol=tol, maxiter=maxiter)
+    return _expand(m, observed, pointings[0].npix), residuals
+
+
+def _expand(m, observed, npix):
+    signal_sum = np.zeros(npix)
+    hits = np.zeros(npix)
+    signal_sum[observed] = m
+    hits[observed] = 1.
+    return normalize_map(signal_sum, hits)
+
+
+def destripe(pointings, tods, noise, baseline_length=1000, tol=1e-6, maxiter=200):
+    """
+    Destriped map of several days: baselines (offsets of baseline_length samples) are fitted
+    with the 1/f noise as prior, subtracted, and the cleaned TOD binned with white weights.
+
+    Args:
+        pointings (list): PointingMatrix of every day (without weights).
+        tods (list): TOD of every day.
+        noise (OneOverFNoise or list): noise model (of every day).
+        baseline_length (int): samples per baseline (well below fs / fknee).
+
+    Returns:
+        final_map, baselines, residuals: full-sky map, list of baselines of every day, PCG residuals.
+    """
+    noise = _per_day(noise, len(tods))
+    local, observed = _common_pixels(pointings)
+    weights = [1 / n.a for n in noise]
+    tods = [np.asarray(tod, dtype=float) for tod in tods]
+    nbaselines = [-(-len(tod) // baseline_length) for tod in tods]
+    priors = [n.baseline_inverse_filter(nb, baseline_length) for n, nb in zip(noise, nbaselines)]
+    hits = sum(w * P.hits for w, P in zip(weights, local))
+
+    def F(x, n):
+        return np.repeat(x, baseline_length)[:n]
+
+    def Ft(v):
+        return np.add.reduceat(v, np.arange(0, len(v), baseline_length))
+
+    def Z(vs):
+        ### white-weighted residual after binning: W (v - P (P^T W P)^-1 P^T W v), over all days
+        m = sum(w * P.bin(v) for w, P, v in zip(weights, local, vs)) / np.where(hits > 0, hits, 1.)
+        return [w * (v - P.project(m)) for w, P, v in zip(weights, local, vs)]
+
+    splits = np.cumsum(nbaselines)[:-1]
+
+    def apply_A(x):
+        xs = np.split(x, splits)
+        zs = Z([F(xk, len(tod)) for xk, tod in zip(xs, tods)])
+        return np.concatenate([Ft(z) + apply_filter(xk, prior) for z, xk, prior in zip(zs, xs, priors)])
+
+    ### block-diagonal preconditioner: one block per baseline, F^T W F + diagonal of the prior
+    counts = [np.diff(np.append(np.arange(0, len(tod), baseline_length), len(tod))) for tod in tods]
+    diagonal = np.concatenate([w * c + np.fft.irfft(prior, n=nb)[0]
+                               for w, c, prior, nb in zip(weights, counts, priors, nbaselines)])
+    rhs = np.concatenate([Ft(z) for z in Z(tods)])
+    x, residuals = pcg(apply_A, rhs, lambda r: r / diagonal, tol=tol, maxiter=maxiter)
+
+    baselines = np.split(x, splits)
+    cleaned = [tod - F(xk, len(tod)) for tod, xk in zip(tods, baselines)]
+    signal_sum = np.zeros(pointings[0].npix)
+    signal_sum[observed] = sum(w * P.bin(v) for w, P, v in zip(weights, local, cleaned))
+    full_hits = np.zeros(pointings[0].npix)
+    full_hits[observed] = hits
+    return normalize_map(signal_sum, full_hits), baselines, residuals
+
+
+if __name__ == "__main__":
+    # Destriped map of days 0-8, with the noise model fitted on day 0: python destriping.py
+    import healpy as hp
+    import matplotlib.pyplot as plt
+    from astropy.io import fits
+    from mapmaking import PointingMatrix, day_files
+
+    nside = 128
+    ndays = 9
+    noise, errors, _ = estimate_noise(day_files(0)[0])
+    print(f"Noise model: a = {noise.a:.3e} ± {errors[0]:.1e}, b = {noise.b:.3e} ± {errors[1]:.1e}")
+    pointings = [PointingMatrix.from_pointing_file(day_files(day)[1], nside) for day in range(ndays)]
+    tods = [fits.getdata(day_files(day)[0]).astype(float) for day in range(ndays)]
+    final_map, baselines, residuals = destripe(pointings, tods, noise)
+    print(f"Destriping converged in {len(residuals) - 1} iterations (residual {residuals[-1]:.1e})")
+    hp.write_map("destriped_map.fits", final_map, overwrite=True)
+    hp.gnomview(final_map, coord='G', reso=30, min=-200, max=200, title="Destriped map (Days 0–8)")
+    hp.graticule()
+    plt.show()
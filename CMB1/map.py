@@ -1,6 +1,7 @@
 import numpy as np
 import healpy as hp
 import matplotlib.pyplot as plt
+from mapmaking import bin_tod
 
 # --- Load Data from Files ---
 # Load TOD (1D array)
@@ -15,9 +16,7 @@ theta = np.pi/2 - lat            # HEALPix theta [0, π]
 # --- Bin TOD into HEALPix Map ---
 nside = 64                       # Pixel resolution (must be power of 2)
 pixel_indices = hp.ang2pix(nside, theta, lon)
-hpx_map = np.zeros(hp.nside2npix(nside))
-for i, pix in enumerate(pixel_indices):
-    hpx_map[pix] += tod[i]       # Sum TOD per pixel (or use np.bincount)
+hpx_map, _ = bin_tod(pixel_indices, tod, hp.nside2npix(nside))   # Sum TOD per pixel
 
 # --- Plot ---
 hp.mollview(hpx_map, title="TOD Binned into HEALPix Map", unit="ΔT")
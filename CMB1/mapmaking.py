@@ -0,0 +1,302 @@
+import os
+import multiprocessing
+import numpy as np
+import healpy as hp
+from astropy.io import fits
+from pixcache import load_pixel_index
+from prefetch import prefetch
+
+# --- Map-making helpers shared by the per-day and combined map scripts ---
+
+
+def galactic_pixels(l, b, nside):
+    """
+    HEALPix pixel (RING ordering) of galactic coordinates in degrees.
+
+    Same pixels as SkyCoord(l, b, frame="galactic") followed by
+    hp.ang2pix(nside, pi/2 - b, l), without building the SkyCoord.
+    """
+    return hp.ang2pix(nside, np.asarray(l, dtype=float), np.asarray(b, dtype=float), lonlat=True)
+
+
+def bin_tod(pixels, tod, npix, weights=None):
+    """
+    Bins a TOD into pixels with a vectorized scatter-add (np.bincount).
+
+    Args:
+        pixels (array): pixel index of every sample.
+        tod (array): TOD samples.
+        npix (int): number of pixels of the map.
+        weights (array): optional weight of every sample (e.g. inverse noise variance).
+
+    Returns:
+        signal_sum, hits: sum of (weighted) TOD and number of hits (or sum of weights) per pixel.
+    """
+    pixels = np.asarray(pixels)
+    if weights is None:
+        hits = np.bincount(pixels, minlength=npix).astype(float)
+        return np.bincount(pixels, weights=tod, minlength=npix), hits
+    weights = np.asarray(weights, dtype=float)
+    return np.bincount(pixels, weights=weights * tod, minlength=npix), np.bincount(pixels, weights=weights, minlength=npix)
+
+
+def normalize_map(signal_sum, hits):
+    """Binned map signal_sum / hits, hp.UNSEEN in pixels without hits."""
+    final_map = np.full(len(hits), hp.UNSEEN)
+    valid = hits > 0
+    final_map[valid] = signal_sum[valid] / hits[valid]
+    return final_map
+
+
+def make_map(l, b, tod, nside=128, weights=None):
+    """
+    Binned map of a TOD pointed at galactic coordinates l, b (degrees).
+
+    Returns:
+        final_map, signal_sum, hits
+    """
+    pointing = PointingMatrix.from_galactic(l, b, nside, weights=weights)
+    signal_sum = pointing.bin(tod)
+    return normalize_map(signal_sum, pointing.hits), signal_sum, pointing.hits
+
+
+# --- Pointing matrix ---
+
+class PointingMatrix:
+    """
+    Sparse pointing matrix P (one pixel per sample) with optional sample weights W
+    (diagonal inverse noise variance), stored as compact pixel indices.
+
+    project: map -> TOD (P m), bin: TOD -> map (P^T W d), hits: P^T W P (diagonal).
+    Built once per day and shared by the binner, the iterative map-makers and simulations.
+
+    Args:
+        pixels (array): pixel of every sample.
+        npix (int): number of pixels of the maps.
+        weights (array): optional weight of every sample.
+    """
+    def __init__(self, pixels, npix, weights=None):
+        dtype = np.int32 if npix < 2**31 else np.int64
+        self.pixels = pixels if isinstance(pixels, np.memmap) and pixels.dtype == dtype else np.asarray(pixels, dtype=dtype)
+        self.npix = npix
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.hits = np.bincount(self.pixels, weights=self.weights, minlength=npix).astype(float)
+
+    @classmethod
+    def from_galactic(cls, l, b, nside, weights=None):
+        return cls(galactic_pixels(l, b, nside), hp.nside2npix(nside), weights=weights)
+
+    @classmethod
+    def from_pointing_file(cls, pointing_file, nside, weights=None):
+        """From the cached pixel index of a pointing file (no coordinate work after the first run)."""
+        return cls(load_pixel_index(pointing_file, nside), hp.nside2npix(nside), weights=weights)
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def project(self, sky_map):
+        """TOD seen by the pointing on sky_map (P m)."""
+        return np.asarray(sky_map)[self.pixels]
+
+    def bin(self, tod):
+        """Weighted sum of the TOD per pixel (P^T W d)."""
+        tod = tod if self.weights is None else self.weights * tod
+        return np.bincount(self.pixels, weights=tod, minlength=self.npix)
+
+    def map(self, tod):
+        """Binned map (P^T W P)^-1 P^T W d, hp.UNSEEN in pixels without hits."""
+        return normalize_map(self.bin(tod), self.hits)
+
+    def observed(self):
+        """Pixels hit at least once."""
+        return np.nonzero(self.hits > 0)[0]
+
+    def compress(self, observed=None):
+        """
+        Same pointing restricted to the observed pixels (maps of len(observed) values).
+
+        Args:
+            observed (array): sorted pixels to keep (containing all the hit pixels), self.observed() if None.
+
+        Returns:
+            PointingMatrix, observed: the compressed matrix and the full-sky index of its pixels.
+        """
+        if observed is None:
+            observed = self.observed()
+        return PointingMatrix(np.searchsorted(observed, self.pixels), len(observed), weights=self.weights), observed
+
+
+# --- Streaming accumulation over days ---
+
+def iter_day_chunks(tod_file, pointing_file, chunk=2**20, start=0, stop=None):
+    """
+    Galactic longitude, latitude and TOD of samples start:stop of a day, by chunks of
+    samples read from memory-mapped FITS files (pointing rows 5 and 6 are b and l).
+    """
+    with fits.open(tod_file, memmap=True) as hdul_tod, fits.open(pointing_file, memmap=True) as hdul_point:
+        tod = hdul_tod[0].data
+        point_array = hdul_point[0].data
+        stop = len(tod) if stop is None else min(stop, len(tod))
+        for i in range(start, stop, chunk):
+            j = min(i + chunk, stop)
+            yield (np.array(point_array[6, i:j], dtype=float), np.array(point_array[5, i:j], dtype=float),
+                   np.array(tod[i:j], dtype=float))
+
+
+def iter_pixel_chunks(tod_file, pixels, chunk=2**20, start=0, stop=None):
+    """Pixels (from a pixel index) and TOD of samples start:stop of a day, by chunks of samples."""
+    with fits.open(tod_file, memmap=True) as hdul_tod:
+        tod = hdul_tod[0].data
+        stop = len(tod) if stop is None else min(stop, len(tod))
+        for i in range(start, stop, chunk):
+            j = min(i + chunk, stop)
+            yield np.array(pixels[i:j]), np.array(tod[i:j], dtype=float)
+
+
+def day_files(day, tod_dir="TOD", pointing_dir="Pointings"):
+    """TOD and pointing FITS files of a day."""
+    return os.path.join(tod_dir, f"TOD_day{day}.fits"), os.path.join(pointing_dir, f"pointing_day{day}.fits")
+
+
+class MapAccumulator:
+    """
+    Running sum and hit maps, plus running mean of the pointing (plot centre),
+    filled chunk by chunk: memory does not depend on the number of samples or days.
+    """
+    def __init__(self, nside=128):
+        self.nside = nside
+        self.npix = hp.nside2npix(nside)
+        self.signal_sum = np.zeros(self.npix)
+        self.hits = np.zeros(self.npix)
+        self.nsamples = 0
+        self.l_sum = 0.
+        self.b_sum = 0.
+
+    def add(self, l, b, tod, weights=None):
+        signal_sum, hits = bin_tod(galactic_pixels(l, b, self.nside), tod, self.npix, weights=weights)
+        self.signal_sum += signal_sum
+        self.hits += hits
+        self.nsamples += len(tod)
+        self.l_sum += np.sum(l)
+        self.b_sum += np.sum(b)
+        return self
+
+    def add_pointing(self, pointing, tod):
+        """Same as add with a PointingMatrix (the pointing statistics are not updated)."""
+        self.signal_sum += pointing.bin(tod)
+        self.hits += pointing.hits
+        return self
+
+    def add_pixels(self, pixels, tod, weights=None):
+        """Same as add with precomputed pixels (the pointing statistics are not updated)."""
+        signal_sum, hits = bin_tod(pixels, tod, self.npix, weights=weights)
+        self.signal_sum += signal_sum
+        self.hits += hits
+        return self
+
+    def add_day(self, tod_file, pointing_file, chunk=2**20, start=0, stop=None, cached=False, depth=2):
+        """
+        Adds samples start:stop of a day. With cached, the pixels are read from the pixel
+        index file of the pointing file (built on first use) instead of being recomputed.
+        The next depth chunks are read on a background thread while a chunk is binned.
+        """
+        if not cached:
+            for l, b, tod in prefetch(iter_day_chunks(tod_file, pointing_file, chunk=chunk, start=start, stop=stop), depth):
+                self.add(l, b, tod)
+            return self
+        pixels, header = load_pixel_index(pointing_file, self.nside, with_header=True)
+        stop = header['nsamples'] if stop is None else min(stop, header['nsamples'])
+        for pix, tod in prefetch(iter_pixel_chunks(tod_file, pixels, chunk=chunk, start=start, stop=stop), depth):
+            self.add_pixels(pix, tod)
+        self.nsamples += max(stop - start, 0)
+        ### pointing sums of a whole day are in the index header, part of a day reads them
+        if start == 0 and stop == header['nsamples']:
+            self.l_sum += header['lon_sum']
+            self.b_sum += header['lat_sum']
+        else:
+            with fits.open(pointing_file, memmap=True) as hdul_point:
+                point_array = hdul_point[0].data
+                for i in range(start, stop, chunk):
+                    self.l_sum += np.sum(point_array[6, i:min(i + chunk, stop)], dtype=float)
+                    self.b_sum += np.sum(point_array[5, i:min(i + chunk, stop)], dtype=float)
+        return self
+
+    def merge(self, other):
+        """Adds the maps and pointing statistics of another accumulator (same nside)."""
+        self.signal_sum += other.signal_sum
+        self.hits += other.hits
+        self.nsamples += other.nsamples
+        self.l_sum += other.l_sum
+        self.b_sum += other.b_sum
+        return self
+
+    def center(self):
+        """Mean galactic longitude and latitude of all samples."""
+        return self.l_sum / self.nsamples, self.b_sum / self.nsamples
+
+    def map(self):
+        return normalize_map(self.signal_sum, self.hits)
+
+
+# --- Parallel map-making ---
+
+def tree_reduce(accumulators):
+    """Merges partial accumulators pairwise, level by level (the first one is reused)."""
+    accumulators = list(accumulators)
+    while len(accumulators) > 1:
+        merged = [a.merge(b) for a, b in zip(accumulators[0::2], accumulators[1::2])]
+        if len(accumulators) % 2:
+            merged.append(accumulators[-1])
+        accumulators = merged
+    return accumulators[0]
+
+
+def _partial_map(args):
+    ### one task: samples start:stop of one day
+    day, start, stop, nside, chunk, cached, tod_dir, pointing_dir = args
+    return day, MapAccumulator(nside).add_day(*day_files(day, tod_dir, pointing_dir), chunk=chunk, start=start, stop=stop,
+                                              cached=cached)
+
+
+def _pixel_index_day(args):
+    day, nside, tod_dir, pointing_dir = args
+    load_pixel_index(day_files(day, tod_dir, pointing_dir)[1], nside)
+
+
+def make_maps(days, nside=128, nproc=None, task_samples=None, chunk=2**20, cached=True, tod_dir="TOD",
+              pointing_dir="Pointings"):
+    """
+    Per-day and combined binned maps, the days (or blocks of task_samples samples within
+    the days) being binned in a process pool.
+
+    Args:
+        days (list): day numbers.
+        nproc (int): worker processes, all cores if None (no pool if 1).
+        task_samples (int): samples per task, whole days if None.
+        chunk (int): samples read at once by a worker.
+        cached (bool): read the pixels from pixel index files (built once per day) instead
+            of converting the pointing.
+
+    Returns:
+        combined, per_day: MapAccumulator of all days and dict day -> MapAccumulator.
+    """
+    tasks = []
+    for day in days:
+        nsamples = fits.getheader(day_files(day, tod_dir, pointing_dir)[0])['NAXIS1']
+        step = task_samples or nsamples
+        tasks += [(day, start, start + step, nside, chunk, cached, tod_dir, pointing_dir)
+                  for start in range(0, nsamples, step)]
+    def run(pmap):
+        ### missing or stale pixel indices are built once per day, before the tasks read them
+        if cached:
+            list(pmap(_pixel_index_day, [(day, nside, tod_dir, pointing_dir) for day in days]))
+        return list(pmap(_partial_map, tasks))
+    if nproc == 1:
+        results = run(map)
+    else:
+        with multiprocessing.Pool(nproc) as pool:
+            results = run(pool.map)
+    per_day = {day: tree_reduce([acc for d, acc in results if d == day] or [MapAccumulator(nside)]) for day in days}
+    ### copies, so that merging into the combined map leaves the per-day maps untouched
+    combined = tree_reduce([MapAccumulator(nside).merge(per_day[day]) for day in days])
+    return combined, per_day
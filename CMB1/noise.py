@@ -0,0 +1,155 @@
+import numpy as np
+from astropy.io import fits
+from scipy.optimize import curve_fit
+from prefetch import prefetch
+
+# --- Noise characterisation of a TOD ---
+# Welch power spectrum: the TOD is streamed in Hann-windowed segments overlapping by half, whose
+# periodograms are averaged (memory of one segment, whatever the TOD length). The spectrum is
+# then averaged in logarithmic frequency bins and N(f) = a + b/f fitted to the bins.
+# Normalisation: white noise of variance sigma^2 per sample has PSD sigma^2 (a = sigma^2), the
+# convention of OneOverFNoise in the map-makers.
+
+
+class OneOverFNoise:
+    """
+    Noise power spectrum N(f) = a + b / f.
+
+    Args:
+        a, b (float): white level and 1/f amplitude (e.g. from fit_noise).
+        fs (float): sampling frequency in Hz.
+    """
+    def __init__(self, a, b, fs=1000.):
+        self.a = a
+        self.b = b
+        self.fs = fs
+
+    def psd(self, f):
+        return self.a + self.b / f
+
+    def fknee(self):
+        return self.b / self.a
+
+    def _inverse(self, power, n, d):
+        ### 1 / power on the rfft frequencies, the f = 0 bin taking the value of the first frequency
+        freqs = np.fft.rfftfreq(n, d=d)
+        freqs[0] = freqs[1] if n > 1 else 1.
+        return 1 / power(freqs)
+
+    def inverse_filter(self, n):
+        """1 / N(f) on the rfft frequencies of n samples."""
+        return self._inverse(self.psd, n, 1 / self.fs)
+
+    def baseline_inverse_filter(self, nbaselines, baseline_length):
+        """
+        Inverse prior of baselines (averages of baseline_length samples) on the rfft frequencies
+        of nbaselines baselines: low-frequency (1/f) power divided by baseline_length.
+        """
+        return self._inverse(lambda f: self.b / f / baseline_length, nbaselines, baseline_length / self.fs)
+
+
+def welch_psd(chunks, fs=1000., nperseg=2**16):
+    """
+    Averaged periodogram of a TOD given as an iterable of consecutive chunks (any sizes).
+
+    Args:
+        chunks (iterable): consecutive pieces of the TOD (or a single array).
+        fs (float): sampling frequency in Hz.
+        nperseg (int): samples per segment (frequency resolution fs / nperseg).
+
+    Returns:
+        freqs, psd, nseg: rfft frequencies of a segment, average PSD, number of segments.
+    """
+    if isinstance(chunks, np.ndarray):
+        chunks = [chunks]
+    step = nperseg // 2
+    window = np.hanning(nperseg)
+    norm = np.sum(window**2)
+    psd_sum = np.zeros(nperseg // 2 + 1)
+    nseg = 0
+    buffer = np.zeros(0)
+    for chunk in chunks:
+        buffer = np.concatenate([buffer, np.asarray(chunk, dtype=float)])
+        nfull = (len(buffer) - nperseg) // step + 1 if len(buffer) >= nperseg else 0
+        for k in range(nfull):
+            segment = buffer[k * step:k * step + nperseg]
+            psd_sum += np.abs(np.fft.rfft((segment - np.mean(segment)) * window))**2
+        nseg += nfull
+        buffer = buffer[nfull * step:]
+    if nseg == 0:
+        raise ValueError(f"TOD shorter than one segment ({nperseg} samples)")
+    psd = psd_sum / nseg / norm
+    return np.fft.rfftfreq(nperseg, d=1 / fs), psd, nseg
+
+
+def log_bin(freqs, psd, nseg, nbins=50, window=None):
+    """
+    Averages a Welch spectrum in logarithmic frequency bins. f = 0 and the first frequency
+    (biased low by the mean removal, through the main lobe of the window) are excluded.
+
+    The bin frequency is the harmonic mean of its frequencies, so that a + b/f at that
+    frequency is the mean of a + b/f over the bin. The errors account for the correlation
+    of neighbouring frequencies (window) and of overlapping segments.
+
+    Returns:
+        freqs, psd, sigma: frequency, mean PSD and its error in the non-empty bins.
+    """
+    f, p = freqs[2:], psd[2:]
+    edges = np.geomspace(f[0], f[-1] * (1 + 1e-12), nbins + 1)
+    index = np.digitize(f, edges) - 1
+    counts = np.bincount(index, minlength=nbins)[:nbins]
+    ok = counts > 0
+    fbin = counts[ok] / np.bincount(index, weights=1 / f, minlength=nbins)[:nbins][ok]
+    pbin = np.bincount(index, weights=p, minlength=nbins)[:nbins][ok] / counts[ok]
+    ### every frequency of every segment is chi2 with 2 degrees of freedom (relative error 1),
+    ### times the variance factors of averaging correlated frequencies and overlapping segments
+    if window is None:
+        window = np.hanning(2 * (len(freqs) - 1))
+    w2 = window**2
+    freq_factor = len(window) * np.sum(w2**2) / np.sum(w2)**2
+    step = len(window) // 2
+    overlap_factor = 1 + 2 * (np.sum(window[:-step] * window[step:])**2 / np.sum(w2)**2)
+    return fbin, pbin, pbin * np.sqrt(np.minimum(freq_factor, counts[ok]) * overlap_factor / (counts[ok] * nseg))
+
+
+def fit_noise(freqs, psd, sigma, fs=1000., niter=3):
+    """
+    Fits N(f) = a + b/f to a binned spectrum. The errors, relative to the measured PSD,
+    are rescaled to the fitted model and the fit repeated (errors proportional to the
+    noisy data would favour downward fluctuations).
+
+    Returns:
+        OneOverFNoise, errors: fitted model and the errors on (a, b).
+    """
+    def model(f, a, b):
+        return a + b / f
+    relative = sigma / psd
+    high = np.median(psd[len(psd) // 2:])
+    popt = (high, max(psd[0] - high, 0) * freqs[0])
+    for i in range(niter):
+        popt, pcov = curve_fit(model, freqs, psd, p0=popt, sigma=relative * model(freqs, *popt),
+                               absolute_sigma=True, maxfev=5000)
+    return OneOverFNoise(popt[0], popt[1], fs=fs), np.sqrt(np.diag(pcov))
+
+
+def iter_tod_chunks(tod_file, chunk=2**20):
+    """TOD of a FITS file by chunks of samples, read memory-mapped."""
+    with fits.open(tod_file, memmap=True) as hdul:
+        tod = hdul[0].data.ravel()
+        for start in range(0, len(tod), chunk):
+            yield np.array(tod[start:start + chunk], dtype=float)
+
+
+def estimate_noise(tod, fs=1000., nperseg=2**16, nbins=50):
+    """
+    Noise model of a TOD (array, iterable of chunks or FITS file name) at memory independent of its length.
+
+    Returns:
+        OneOverFNoise, errors, (freqs, psd, sigma): fitted model, errors on (a, b) and the binned spectrum.
+    """
+    if isinstance(tod, str):
+        tod = prefetch(iter_tod_chunks(tod))
+    freqs, psd, nseg = welch_psd(tod, fs=fs, nperseg=nperseg)
+    binned = log_bin(freqs, psd, nseg, nbins=nbins)
+    noise, errors = fit_noise(*binned, fs=fs)
+    return noise, errors, binned
@@ -0,0 +1,132 @@
+import os
+import json
+import zlib
+import numpy as np
+import healpy as hp
+from astropy.io import fits
+from prefetch import prefetch
+
+# --- Cached pointing -> HEALPix pixel index files ---
+# Pointing never changes between map-making runs, so the pixel of every sample is computed
+# once per (pointing file, nside, frame) and stored as a compact int32 array (int64 when
+# npix does not fit in int32), read back memory-mapped.
+# Layout: MAGIC | uint64 header size | JSON header (padded to HEADER_SIZE bytes) | raw pixels.
+# The header records size and mtime of the source pointing file (a stale index is rebuilt)
+# and the CRC32 of the pixel data (a corrupted index is rebuilt), plus the sums of the
+# longitudes and latitudes (mean pointing, without reading the pointing again).
+
+MAGIC = b'PIXIDX01'
+HEADER_SIZE = 1024
+
+# Pointing rows (longitude, latitude) of each frame
+FRAMES = {'G': (6, 5), 'C': (3, 4)}
+
+
+def pixel_index_file(pointing_file, nside, frame='G', cache_dir=None):
+    """Index file of a pointing file, next to it unless cache_dir is given."""
+    base = os.path.splitext(os.path.basename(pointing_file))[0]
+    directory = cache_dir if cache_dir is not None else os.path.dirname(pointing_file)
+    return os.path.join(directory, f"{base}.nside{nside}.{frame}.pix")
+
+
+def _source(pointing_file):
+    st = os.stat(pointing_file)
+    return {'name': os.path.basename(pointing_file), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def build_pixel_index(pointing_file, nside, frame='G', index_file=None, chunk=2**20):
+    """
+    Computes the pixels (RING) of all samples of a pointing file, chunk by chunk, and writes the index file.
+
+    Returns:
+        str: path of the index file.
+    """
+    if index_file is None:
+        index_file = pixel_index_file(pointing_file, nside, frame)
+    dtype = np.dtype('<i4') if hp.nside2npix(nside) < 2**31 else np.dtype('<i8')
+    lon_row, lat_row = FRAMES[frame]
+    crc = 0
+    lon_sum = lat_sum = 0.
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with fits.open(pointing_file, memmap=True) as hdul, open(tmp_file, 'wb') as f:
+        point_array = hdul[0].data
+        nsamples = point_array.shape[1]
+        f.write(b'\0' * HEADER_SIZE)
+        chunks = ((np.array(point_array[lon_row, start:start + chunk], dtype=float),
+                   np.array(point_array[lat_row, start:start + chunk], dtype=float)) for start in range(0, nsamples, chunk))
+        for lon, lat in prefetch(chunks):
+            pixels = hp.ang2pix(nside, lon, lat, lonlat=True).astype(dtype).tobytes()
+            crc = zlib.crc32(pixels, crc)
+            lon_sum += np.sum(lon)
+            lat_sum += np.sum(lat)
+            f.write(pixels)
+        header = json.dumps({'version': 1, 'nside': nside, 'frame': frame, 'ordering': 'RING',
+                             'dtype': dtype.str, 'nsamples': nsamples, 'crc32': crc,
+                             'lon_sum': float(lon_sum), 'lat_sum': float(lat_sum),
+                             'source': _source(pointing_file)}).encode()
+        if len(MAGIC) + 8 + len(header) > HEADER_SIZE:
+            raise ValueError("pixel index header too long")
+        f.seek(0)
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+    ### atomic: parallel builders of the same index never leave a partial file
+    os.replace(tmp_file, index_file)
+    return index_file
+
+
+def read_pixel_index(index_file, verify=True):
+    """
+    Memory-mapped pixel indices and the header of an index file.
+
+    Raises:
+        ValueError: not an index file, truncated, or CRC mismatch (with verify).
+    """
+    with open(index_file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{index_file} is not a pixel index file")
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size))
+    dtype = np.dtype(header['dtype'])
+    if os.path.getsize(index_file) != HEADER_SIZE + header['nsamples'] * dtype.itemsize:
+        raise ValueError(f"{index_file} is truncated")
+    if header['nsamples'] == 0:
+        return np.zeros(0, dtype=dtype), header
+    pixels = np.memmap(index_file, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(header['nsamples'],))
+    if verify:
+        crc = 0
+        for start in range(0, len(pixels), 2**22):
+            crc = zlib.crc32(pixels[start:start + 2**22].tobytes(), crc)
+        if crc != header['crc32']:
+            raise ValueError(f"{index_file}: checksum mismatch")
+    return pixels, header
+
+
+def load_pixel_index(pointing_file, nside, frame='G', cache_dir=None, verify=True, with_header=False):
+    """
+    Pixel indices of a pointing file, from its index file, (re)built when missing, stale or corrupted.
+
+    Returns:
+        np.memmap: pixel of every sample (int32 or int64), and the header if with_header.
+    """
+    index_file = pixel_index_file(pointing_file, nside, frame, cache_dir)
+    if os.path.exists(index_file):
+        try:
+            pixels, header = read_pixel_index(index_file, verify=verify)
+            if header['source'] == _source(pointing_file) and header['nside'] == nside and header['frame'] == frame:
+                return (pixels, header) if with_header else pixels
+        except (ValueError, KeyError):
+            pass
+    build_pixel_index(pointing_file, nside, frame, index_file=index_file)
+    pixels, header = read_pixel_index(index_file, verify=False)
+    return (pixels, header) if with_header else pixels
+
+
+if __name__ == "__main__":
+    # Pre-process all pointing files of the current directory: python pixcache.py [nside]
+    import sys
+    import glob
+    nside = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    for pointing_file in sorted(glob.glob(os.path.join("Pointings", "pointing_day*.fits"))):
+        load_pixel_index(pointing_file, nside)
+        print(f"{pixel_index_file(pointing_file, nside)}")
@@ -0,0 +1,67 @@
+import queue
+import threading
+
+# --- Background prefetching of data blocks ---
+# The next blocks (TOD / pointing chunks, whole days...) are read on a background thread
+# while the current one is processed. File reads and numpy copies / byte swaps of the
+# memory-mapped FITS data release the GIL, so reading and binning overlap. The queue is
+# bounded: at most depth blocks are held in memory ahead of the consumer.
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, depth=2):
+    """
+    Iterates over iterable with its items produced up to depth items ahead on a background thread.
+
+    Exceptions raised by the producer are re-raised in the consumer. Leaving the loop early
+    stops the producer and closes iterable (a generator such as iter_day_chunks then closes
+    its files on the background thread).
+    """
+    blocks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        ### retries so that a stopped consumer never leaves the producer blocked
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    items = iter(iterable)
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as error:
+            put(_Failure(error))
+        finally:
+            ### a suspended generator would keep its files open until garbage collected
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = blocks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
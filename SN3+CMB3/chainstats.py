@@ -0,0 +1,318 @@
+import os
+import json
+import numpy as np
+
+# --- Streaming chain storage and summary statistics ---
+# Chains are stored step by step in a binary file (header + raw (nsteps, nwalkers, ndim) float64
+# samples), so that they can be written while sampling and read back in chunks through a memmap.
+# ChainStats summarizes them in a single pass: mean and covariance (pairwise Welford updates),
+# quantiles (t-digest-like centroid sketch), Gelman-Rubin R-hat over walkers, effective sample
+# size from batch means (and the autocorrelation time it implies) and acceptance fraction from
+# the moves of the walkers. Two ChainStats can be merged (parallel runs or parts of a chain).
+
+CHAIN_MAGIC = b'CHAINST1'
+ALIGN = 64
+
+
+class ChainWriter:
+    """
+    Appends steps of an ensemble chain to a binary chain file.
+
+    Args:
+        filename (str): chain file (overwritten).
+        nwalkers, ndim (int): ensemble size and number of parameters.
+        names (list): parameter names.
+    """
+    def __init__(self, filename, nwalkers, ndim, names=None):
+        self.filename = filename
+        self.shape = (nwalkers, ndim)
+        if names is None:
+            names = ['p{}'.format(k) for k in range(ndim)]
+        header = json.dumps({'version': 1, 'nwalkers': nwalkers, 'ndim': ndim, 'names': list(names),
+                             'dtype': '<f8'}).encode()
+        start = -(-(len(CHAIN_MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+        header += b' ' * (start - len(CHAIN_MAGIC) - 8 - len(header))
+        with open(filename, 'wb') as f:
+            f.write(CHAIN_MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+
+    def append(self, steps):
+        """Adds samples of shape (nsteps, nwalkers, ndim) or (nwalkers, ndim)."""
+        steps = np.ascontiguousarray(steps, dtype='<f8').reshape((-1,) + self.shape)
+        with open(self.filename, 'ab') as f:
+            f.write(steps.tobytes())
+
+
+def read_chain(filename):
+    """
+    Memory-mapped chain of shape (nsteps, nwalkers, ndim) and the header of a chain file.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(CHAIN_MAGIC)) != CHAIN_MAGIC:
+            raise ValueError(f"{filename} is not a chain file")
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size))
+    start = len(CHAIN_MAGIC) + 8 + size
+    step_bytes = header['nwalkers'] * header['ndim'] * 8
+    nsteps = (os.path.getsize(filename) - start) // step_bytes
+    if nsteps == 0:
+        return np.zeros((0, header['nwalkers'], header['ndim'])), header
+    chain = np.memmap(filename, dtype=header['dtype'], mode='r', offset=start,
+                      shape=(nsteps, header['nwalkers'], header['ndim']))
+    return chain, header
+
+
+def iter_chain(filename, chunk=1000, burn=0, thin=1):
+    """Chunks of (at most chunk) steps of a chain file, after burn steps and keeping one step in thin."""
+    chain, _ = read_chain(filename)
+    for start in range(burn, len(chain), chunk * thin):
+        yield np.asarray(chain[start:start + chunk * thin:thin])
+
+
+def run_to_file(sampler, p0, nsteps, filename, names=None, buffer=100, progress=False):
+    """
+    Runs an emcee sampler without keeping the chain in memory, writing it to filename.
+
+    Returns:
+        emcee.State: last state (to continue sampling).
+    """
+    nwalkers, ndim = np.shape(p0)
+    writer = ChainWriter(filename, nwalkers, ndim, names)
+    steps = []
+    state = None
+    for state in sampler.sample(p0, iterations=nsteps, store=False, progress=progress):
+        steps.append(np.array(state.coords))
+        if len(steps) == buffer:
+            writer.append(np.array(steps))
+            steps = []
+    if steps:
+        writer.append(np.array(steps))
+    return state
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch: weighted centroids, finer in the tails (t-digest k1 scale).
+
+    Args:
+        compression (float): about the number of centroids kept.
+    """
+    def __init__(self, compression=500):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def update(self, x):
+        x = np.sort(np.ravel(x))
+        self._merge(x, np.ones(len(x)))
+        return self
+
+    def merge(self, other):
+        self._merge(other.means, other.weights)
+        return self
+
+    def _merge(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        ### group consecutive points whose k-scale span stays below 1
+        total = np.sum(weights)
+        q = (np.cumsum(weights) - 0.5 * weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+        group = np.floor(k - k[0]).astype(np.int64)
+        group = np.concatenate([[0], np.cumsum(np.diff(group) != 0)])
+        w = np.bincount(group, weights=weights)
+        self.means = np.bincount(group, weights=weights * means) / w
+        self.weights = w
+
+    def quantile(self, q):
+        cum = (np.cumsum(self.weights) - 0.5 * self.weights) / np.sum(self.weights)
+        return np.interp(q, cum, self.means)
+
+
+class ChainStats:
+    """
+    Single-pass, mergeable summary of ensemble chains.
+
+    Args:
+        ndim (int): number of parameters.
+        names (list): parameter names.
+        batch (int): smallest number of steps per batch for the batch-means effective sample size.
+        nlevels (int): number of batch sizes (doubling from batch).
+        compression (float): size of the quantile sketches.
+    """
+    def __init__(self, ndim, names=None, batch=8, nlevels=12, compression=500):
+        self.ndim = ndim
+        self.names = names if names is not None else ['p{}'.format(k) for k in range(ndim)]
+        self.n = 0
+        self.mean = np.zeros(ndim)
+        self.m2 = np.zeros((ndim, ndim))
+        self.sketches = [QuantileSketch(compression) for _ in range(ndim)]
+        ### per walker (chain) statistics for R-hat: counts, means, sums of squared deviations
+        self.chain_n = np.zeros(0)
+        self.chain_mean = np.zeros((0, ndim))
+        self.chain_m2 = np.zeros((0, ndim))
+        ### per walker accepted moves (a rejected proposal leaves the walker in place) and transitions
+        self.chain_moves = np.zeros(0)
+        self.chain_transitions = np.zeros(0)
+        self._last = None
+        ### batch means for batch sizes batch, 2*batch, 4*batch...: running partial batch per walker,
+        ### and counts / sums / sums of squares of the completed batch means
+        self.batches = batch * 2**np.arange(nlevels)
+        self._partial = None
+        self._partial_n = np.zeros(nlevels, dtype=int)
+        self.nbatch = np.zeros(nlevels, dtype=int)
+        self.batch_sum = np.zeros((nlevels, ndim))
+        self.batch_sum2 = np.zeros((nlevels, ndim))
+
+    def update(self, steps):
+        """Adds consecutive steps of shape (nsteps, nwalkers, ndim)."""
+        steps = np.asarray(steps, dtype=float)
+        nsteps, nwalkers, _ = steps.shape
+        flat = steps.reshape(-1, self.ndim)
+        mean = np.mean(flat, axis=0)
+        self._add_moments(len(flat), mean, (flat - mean).T @ (flat - mean))
+        for k in range(self.ndim):
+            self.sketches[k].update(flat[:, k])
+
+        ### walkers
+        if len(self.chain_n) == 0:
+            self.chain_n = np.zeros(nwalkers)
+            self.chain_mean = np.zeros((nwalkers, self.ndim))
+            self.chain_m2 = np.zeros((nwalkers, self.ndim))
+            self.chain_moves = np.zeros(nwalkers)
+            self.chain_transitions = np.zeros(nwalkers)
+        cm = np.mean(steps, axis=0)
+        delta = cm - self.chain_mean
+        ntot = self.chain_n + nsteps
+        self.chain_m2 += np.sum((steps - cm)**2, axis=0) + delta**2 * (self.chain_n * nsteps / ntot)[:, None]
+        self.chain_mean += delta * (nsteps / ntot)[:, None]
+        self.chain_n = ntot
+        previous = steps[:-1] if self._last is None else np.concatenate([self._last[None], steps[:-1]])
+        self.chain_moves += np.sum(np.any(steps[len(steps) - len(previous):] != previous, axis=2), axis=0)
+        self.chain_transitions += len(previous)
+        self._last = steps[-1].copy()
+
+        ### batch means (batches continue across chunks)
+        if self._partial is None:
+            self._partial = np.zeros((len(self.batches), nwalkers, self.ndim))
+        for lev, b in enumerate(self.batches):
+            i = min(b - self._partial_n[lev], nsteps)
+            self._partial[lev] += np.sum(steps[:i], axis=0)
+            self._partial_n[lev] += i
+            if self._partial_n[lev] < b:
+                continue
+            nfull = (nsteps - i) // b
+            bm = np.concatenate([self._partial[lev][None] / b,
+                                 np.mean(steps[i:i + nfull * b].reshape(nfull, b, nwalkers, self.ndim), axis=1)])
+            self.nbatch[lev] += len(bm) * nwalkers
+            self.batch_sum[lev] += np.sum(bm, axis=(0, 1))
+            self.batch_sum2[lev] += np.sum(bm**2, axis=(0, 1))
+            self._partial[lev] = np.sum(steps[i + nfull * b:], axis=0)
+            self._partial_n[lev] = nsteps - i - nfull * b
+        return self
+
+    def _add_moments(self, n, mean, m2):
+        ### Chan et al. pairwise combination of means and co-moments
+        ntot = self.n + n
+        delta = mean - self.mean
+        self.m2 += m2 + np.outer(delta, delta) * self.n * n / ntot
+        self.mean = self.mean + delta * n / ntot
+        self.n = ntot
+
+    def merge(self, other):
+        """Combines with the statistics of another (independent) run: walkers are concatenated."""
+        self._add_moments(other.n, other.mean, other.m2)
+        for s, o in zip(self.sketches, other.sketches):
+            s.merge(o)
+        self.chain_n = np.concatenate([self.chain_n, other.chain_n])
+        self.chain_mean = np.concatenate([self.chain_mean, other.chain_mean])
+        self.chain_m2 = np.concatenate([self.chain_m2, other.chain_m2])
+        self.chain_moves = np.concatenate([self.chain_moves, other.chain_moves])
+        self.chain_transitions = np.concatenate([self.chain_transitions, other.chain_transitions])
+        self.nbatch += other.nbatch
+        self.batch_sum += other.batch_sum
+        self.batch_sum2 += other.batch_sum2
+        return self
+
+    def covariance(self):
+        return self.m2 / (self.n - 1)
+
+    def std(self):
+        return np.sqrt(np.diag(self.covariance()))
+
+    def quantiles(self, q):
+        """Quantiles q (list), shape (len(q), ndim)."""
+        return np.array([s.quantile(q) for s in self.sketches]).T
+
+    def rhat(self):
+        """Gelman-Rubin statistic with the walkers as chains."""
+        n = np.mean(self.chain_n)
+        W = np.mean(self.chain_m2 / (self.chain_n[:, None] - 1), axis=0)
+        B = n * np.var(self.chain_mean, axis=0, ddof=1)
+        return np.sqrt(((n - 1) / n * W + B / n) / W)
+
+    def ess(self, min_batches=20):
+        """
+        Effective sample size from the variance of the batch means, using the largest batch
+        size with at least min_batches batches per walker (batches much longer than the
+        autocorrelation time).
+        """
+        nsteps = np.min(self.chain_n)
+        ok = np.nonzero((self.nbatch > 0) & (self.batches * min_batches <= nsteps))[0]
+        lev = ok[-1] if len(ok) else 0
+        bmean = self.batch_sum[lev] / self.nbatch[lev]
+        bvar = self.batch_sum2[lev] / self.nbatch[lev] - bmean**2
+        return self.n * np.diag(self.covariance()) / (self.batches[lev] * bvar)
+
+    def autocorr_time(self):
+        """Integrated autocorrelation time in steps, implied by the effective sample size."""
+        return self.n / self.ess()
+
+    def acceptance_fraction(self):
+        """Fraction of the steps where each walker moved (emcee's acceptance fraction)."""
+        return self.chain_moves / np.maximum(self.chain_transitions, 1)
+
+    def summary(self):
+        q = self.quantiles([0.16, 0.5, 0.84])
+        ess, rhat = self.ess(), self.rhat()
+        return {name: {'mean': self.mean[k], 'std': self.std()[k], 'q16': q[0, k], 'median': q[1, k],
+                       'q84': q[2, k], 'ess': ess[k], 'rhat': rhat[k]} for k, name in enumerate(self.names)}
+
+    def __repr__(self):
+        lines = []
+        for name, s in self.summary().items():
+            lines.append(f"{name} = {s['median']:.4f} +{s['q84'] - s['median']:.4f} -{s['median'] - s['q16']:.4f}"
+                         f"  (mean {s['mean']:.4f} ± {s['std']:.4f}, ESS {s['ess']:.0f}, R-hat {s['rhat']:.3f})")
+        return '\n'.join(lines)
+
+
+def chain_statistics(filename, burn=0, chunk=1000, **kw):
+    """ChainStats of a chain file, computed in one pass over chunks of steps."""
+    chain, header = read_chain(filename)
+    stats = ChainStats(header['ndim'], names=header['names'], **kw)
+    for steps in iter_chain(filename, chunk=chunk, burn=burn):
+        stats.update(steps)
+    return stats
+
+
+def write_thinned(filename, output, burn=0, thin=10, chunk=1000):
+    """
+    Writes the flattened chain after burn-in, keeping one step in thin, as float32 .npy.
+
+    Returns:
+        str: output file name.
+    """
+    chain, header = read_chain(filename)
+    nsteps = len(range(burn, len(chain), thin))
+    out = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32,
+                                    shape=(nsteps * header['nwalkers'], header['ndim']))
+    pos = 0
+    for steps in iter_chain(filename, chunk=chunk, burn=burn, thin=thin):
+        flat = steps.reshape(-1, header['ndim'])
+        out[pos:pos + len(flat)] = flat
+        pos += len(flat)
+    out.flush()
+    return output
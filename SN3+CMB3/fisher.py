@@ -0,0 +1,260 @@
+import math
+import numpy as np
+
+import cosmolib as cs
+
+# --- Fisher-matrix forecasts ---
+# F_ab = sum_ij dm_i/dp_a C^-1_ij dm_j/dp_b around a fiducial cosmology (cosmolib dict).
+# Distance derivatives w.r.t. omega_M_0, omega_lambda_0 and w0 are analytic (one integration
+# of E(z) and of its derivatives on the propdist grid); other parameters, rs and the CMB D_l
+# spectrum use central finite differences. Probes are combined by adding Fisher objects.
+
+FIDUCIAL = {'omega_M_0': 0.3, 'omega_lambda_0': 0.7, 'w0': -1., 'h': 0.7,
+            'omega_b_0': 0.048, 'omega_n_0': 0.}
+
+# Relative (or absolute for parameters at 0) steps of the finite differences
+STEP = 1e-3
+
+# Parameters whose distance derivatives are analytic
+ANALYTIC = ['omega_M_0', 'omega_lambda_0', 'w0']
+
+
+class Fisher:
+    """
+    Fisher matrix with named parameters.
+
+    Fisher objects over different parameter sets can be added (missing entries are zero),
+    and priors, fixed and marginalized parameters are handled by name.
+    """
+    def __init__(self, matrix, params):
+        self.matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+        self.params = list(params)
+
+    def __add__(self, other):
+        params = self.params + [p for p in other.params if p not in self.params]
+        matrix = np.zeros((len(params), len(params)))
+        for f in (self, other):
+            idx = [params.index(p) for p in f.params]
+            matrix[np.ix_(idx, idx)] += f.matrix
+        return Fisher(matrix, params)
+
+    def __repr__(self):
+        return 'Fisher({})'.format(', '.join(f'{p}: {e:.3g}' for p, e in zip(self.params, self.errors())))
+
+    def add_prior(self, name, sigma):
+        """Gaussian prior of width sigma on one parameter."""
+        return self + Fisher([[1. / sigma**2]], [name])
+
+    def fix(self, names):
+        """Fisher matrix of the other parameters, the given ones being known."""
+        keep = [i for i, p in enumerate(self.params) if p not in names]
+        return Fisher(self.matrix[np.ix_(keep, keep)], [self.params[i] for i in keep])
+
+    def marginalize(self, names):
+        """Fisher matrix of the other parameters, the given ones being marginalized."""
+        keep = [p for p in self.params if p not in names]
+        idx = [self.params.index(p) for p in keep]
+        cov = self.covariance()[np.ix_(idx, idx)]
+        return Fisher(np.linalg.inv(cov), keep)
+
+    def covariance(self):
+        return np.linalg.inv(self.matrix)
+
+    def errors(self):
+        """Marginalized 1-sigma errors."""
+        return np.sqrt(np.diag(self.covariance()))
+
+    def error(self, name):
+        return self.errors()[self.params.index(name)]
+
+    def correlation(self):
+        cov = self.covariance()
+        d = np.sqrt(np.diag(cov))
+        return cov / np.outer(d, d)
+
+    def ellipse(self, name1, name2, nsig=1., npts=100):
+        """Points of the nsig Gaussian contour of (name1, name2) around 0 (add the fiducial values)."""
+        i, j = self.params.index(name1), self.params.index(name2)
+        cov = self.covariance()[np.ix_([i, j], [i, j])]
+        # Delta chi2 of the 2-D confidence region with the same probability as nsig in 1-D
+        dchi2 = -2 * np.log(1 - math.erf(nsig / np.sqrt(2)))
+        phi = np.linspace(0, 2 * np.pi, npts)
+        return np.sqrt(dchi2) * np.linalg.cholesky(cov) @ np.array([np.cos(phi), np.sin(phi)])
+
+
+def fisher_from_jacobian(jac, params, cov):
+    """
+    F = J C^-1 J^T.
+
+    Args:
+        jac (array): derivatives, shape (len(params), ndata).
+        params (list): parameter names.
+        cov (array): errors (size ndata) or covariance matrix of the data.
+    """
+    jac = np.atleast_2d(jac)
+    if np.ndim(cov) == 1:
+        wjac = jac / np.asarray(cov)**2
+    else:
+        wjac = jac @ np.linalg.inv(cov)
+    return Fisher(wjac @ jac.T, params)
+
+
+def finite_differences(func, cosmo, params, step=STEP):
+    """Central differences of func(cosmo) (scalar or array) w.r.t. params, shape (len(params), ...)."""
+    derivs = []
+    for p in params:
+        h = step * abs(cosmo[p]) if cosmo[p] != 0 else step
+        up, down = dict(cosmo), dict(cosmo)
+        up[p] += h
+        down[p] -= h
+        derivs.append((np.asarray(func(up)) - np.asarray(func(down))) / (2 * h))
+    return np.array(derivs)
+
+
+def comoving_derivatives(z, cosmo, zres=0.001):
+    """
+    Dimensionless transverse comoving distance D(z) (in units of c/H0) and its analytic
+    derivatives w.r.t. ANALYTIC, integrated on the same grid as cosmolib.propdist.
+
+    Returns:
+        D (array), dD (array of shape (len(ANALYTIC), len(z))).
+    """
+    om, ol, w0 = cosmo['omega_M_0'], cosmo['omega_lambda_0'], cosmo['w0']
+    ok = 1. - om - ol
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+    zmax = np.max(z)
+    nb = 101 if zmax < zres else int(zmax / zres + 1)
+    zvals = np.linspace(0., zmax, nb)
+    a2, a3, ax = (1 + zvals)**2, (1 + zvals)**3, (1 + zvals)**(3 + 3 * w0)
+    e2 = ok * a2 + ol * ax + om * a3
+    ### chi = int dz / E and d chi / dp = - int dE2/dp / (2 E^3) dz
+    integrands = np.array([e2**-0.5,
+                           -0.5 * e2**-1.5 * (a3 - a2),
+                           -0.5 * e2**-1.5 * (ax - a2),
+                           -0.5 * e2**-1.5 * ol * 3 * np.log(1 + zvals) * ax])
+    cumulative = np.zeros((4, nb))
+    cumulative[:, 1:] = np.cumsum((integrands[:, 1:] + integrands[:, :-1]) * (0.5 * (zvals[1] - zvals[0])), axis=1)
+    vals = np.array([np.interp(z, zvals, c) for c in cumulative])
+    chi, dchi = vals[0], vals[1:]
+    ### Curvature: D = S_k(chi), dD/dp = C_k(chi) dchi/dp + dS_k/dok dok/dp (dok/dp = -1, -1, 0)
+    k = np.abs(ok)
+    sk = np.sqrt(k)
+    if k < 1e-8:
+        D, C, dD_dok = chi, np.ones_like(chi), chi**3 / 6
+    elif ok > 0:
+        D, C = np.sinh(sk * chi) / sk, np.cosh(sk * chi)
+        dD_dok = (chi * C - D) / (2 * k)
+    else:
+        D, C = np.sin(sk * chi) / sk, np.cos(sk * chi)
+        dD_dok = -(chi * C - D) / (2 * k)
+    dD = C * dchi + np.array([-1., -1., 0.])[:, None] * dD_dok
+    return D, dD
+
+
+def musn1a_derivatives(z, cosmo, params):
+    """d musn1a / d params at redshifts z, shape (len(params), len(z))."""
+    D, dD = comoving_derivatives(z, cosmo)
+    derivs = []
+    for p in params:
+        if p in ANALYTIC:
+            derivs.append(5 / np.log(10) * dD[ANALYTIC.index(p)] / D)
+        elif p == 'h':
+            # h cancels in musn1a (fixed to 0.7 in the absolute magnitude)
+            derivs.append(np.zeros(len(D)))
+        elif p == 'M':
+            derivs.append(np.ones(len(D)))
+        else:
+            derivs.append(finite_differences(lambda c: cs.musn1a(z, c), cosmo, [p])[0])
+    return np.array(derivs)
+
+
+def thetastar_derivatives(cosmo, params, zstar=1090.49):
+    """
+    d thetastar / d params. theta* = rs h 100 / (c D(z*)): rs by finite differences,
+    D analytic.
+    """
+    theta = cs.thetastar(cosmo, zstar=zstar)
+    D, dD = comoving_derivatives(zstar, cosmo)
+    derivs = []
+    for p in params:
+        dlnrs = finite_differences(lambda c: cs.rs(c, zd=zstar), cosmo, [p])[0] / cs.rs(cosmo, zd=zstar)
+        if p in ANALYTIC:
+            dlntheta = dlnrs - dD[ANALYTIC.index(p), 0] / D[0]
+        elif p == 'h':
+            dlntheta = dlnrs + 1. / cosmo['h']
+        else:
+            dlntheta = dlnrs
+        derivs.append(theta * dlntheta)
+    return np.array(derivs)
+
+
+def camb_dl(ell, cosmo, ombh2=0.02079, tau=0.079, As=np.exp(3.094) / 1e10, ns=0.9645):
+    """CMB TT D_l [muK^2] from CAMB, same settings as the CMB analysis of final.ipynb."""
+    import camb
+    h = cosmo['h']
+    pars = camb.CAMBparams()
+    pars.set_cosmology(H0=100 * h, ombh2=ombh2, omch2=cosmo['omega_M_0'] * h**2 - ombh2,
+                       omk=1 - cosmo['omega_M_0'] - cosmo['omega_lambda_0'], tau=tau)
+    pars.InitPower.set_params(As=As, ns=ns)
+    pars.set_for_lmax(int(np.max(ell)) + 50, lens_potential_accuracy=0)
+    powers = camb.get_results(pars).get_cmb_power_spectra(pars, CMB_unit='muK', raw_cl=False)
+    return powers['total'][np.asarray(ell).astype(int), 0]
+
+
+def sn_fisher(z, sigma, cosmo=FIDUCIAL, params=ANALYTIC, sigma_int=0., marg_offset=True):
+    """
+    Supernova distance-modulus Fisher matrix.
+
+    Args:
+        z (array): redshifts of the (real or synthetic) sample.
+        sigma (float or array): distance-modulus errors.
+        cosmo (dict): fiducial cosmology.
+        params (list): forecast parameters.
+        sigma_int (float): intrinsic scatter added in quadrature.
+        marg_offset (bool): marginalize the absolute magnitude offset (degenerate with h).
+
+    Returns:
+        Fisher
+    """
+    z = np.asarray(z, dtype=float)
+    err = np.sqrt(np.broadcast_to(sigma, z.shape)**2 + sigma_int**2)
+    if marg_offset:
+        f = fisher_from_jacobian(musn1a_derivatives(z, cosmo, list(params) + ['M']), list(params) + ['M'], err)
+        return f.marginalize(['M'])
+    return fisher_from_jacobian(musn1a_derivatives(z, cosmo, params), params, err)
+
+
+def thetastar_fisher(sigma_theta, cosmo=FIDUCIAL, params=('omega_M_0', 'omega_lambda_0', 'h')):
+    """Fisher matrix of a measurement of theta* with error sigma_theta."""
+    return fisher_from_jacobian(thetastar_derivatives(cosmo, params)[:, None], params, [sigma_theta])
+
+
+def cmb_dl_fisher(ell, errors, cosmo=FIDUCIAL, params=('h', 'omega_M_0', 'omega_lambda_0'), dl_model=camb_dl):
+    """Fisher matrix of binned D_l measurements (errors per bin), dl_model(ell, cosmo) by finite differences."""
+    jac = finite_differences(lambda c: dl_model(ell, c), cosmo, params)
+    return fisher_from_jacobian(jac, params, errors)
+
+
+def synthetic_redshifts(n, pdf=None, zmin=0.01, zmax=1.5, nsamp=10000):
+    """
+    n redshifts following the distribution pdf(z) on [zmin, zmax] (uniform if None),
+    placed at the quantiles of the distribution (no sampling noise in the forecast).
+    """
+    zs = np.linspace(zmin, zmax, nsamp)
+    dens = np.ones(nsamp) if pdf is None else pdf(zs)
+    cdf = np.concatenate([[0.], np.cumsum(0.5 * (dens[1:] + dens[:-1]) * np.diff(zs))])
+    return np.interp((np.arange(n) + 0.5) / n, cdf / cdf[-1], zs)
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    # Current sample: 150 SNe up to z~1 with 0.15 mag per object
+    z_now = synthetic_redshifts(150, zmax=1.)
+    current = sn_fisher(z_now, 0.15)
+    print('SN now:', current)
+    # Adding 100 SNe at z~1
+    extra = sn_fisher(synthetic_redshifts(100, lambda z: np.exp(-0.5 * ((z - 1) / 0.1)**2), 0.7, 1.3), 0.15)
+    print('SN + 100 at z~1:', current + extra)
+    # With a 0.3% measurement of theta* and a 3% prior on h (then marginalized)
+    cmb = thetastar_fisher(0.003 * cs.thetastar(FIDUCIAL), params=('omega_M_0', 'omega_lambda_0', 'w0', 'h'))
+    print('SN + theta*:', (current + cmb).add_prior('h', 0.02).marginalize(['h']))
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+from lightcurve import fit_supernova_lightcurve, xcorr_initial_guess
+
+# --- Content-hashed catalog of light-curve fit results ---
+# Every fit is keyed by a hash of its inputs: light-curve content, redshift, template,
+# sigma_int and fitter settings (the last three form the "configuration").
+# Only supernovae whose key is missing from the catalog are refitted. The catalog is a
+# numpy structured table (.npz) plus a JSON provenance record for each configuration.
+# Failed fits are stored too (ok = False, NaN results), so that they are not retried on
+# every run; they are refitted only when their inputs change.
+
+CATALOG_FILE = 'supernova_fit_catalog.npz'
+
+RESULT_DTYPE = np.dtype([
+    ('key', 'S64'), ('config', 'S16'), ('sn_number', 'i8'), ('redshift', 'f8'),
+    ('mu', 'f8'), ('mu_err', 'f8'), ('s', 'f8'), ('s_err', 'f8'), ('t0', 'f8'), ('t0_err', 'f8'),
+    ('chi2', 'f8'), ('ndf', 'i8'), ('chi2_reduced', 'f8'), ('sigma_int_used', 'f8'), ('fitted_at', 'f8'),
+    ('ok', '?'),
+])
+
+# Columns exposed to the analysis (same as the CSV export)
+RESULT_COLUMNS = ['sn_number', 'redshift', 'mu', 'mu_err', 's', 's_err', 't0', 't0_err',
+                  'chi2', 'ndf', 'chi2_reduced', 'sigma_int_used']
+
+
+def fit_config(lc_template, sigma_int, settings=None):
+    """Description of everything but the light curve that determines a fit result."""
+    template = hashlib.sha256()
+    template.update(np.ascontiguousarray(lc_template.template_t, dtype=np.float64).tobytes())
+    template.update(np.ascontiguousarray(lc_template.template_mag, dtype=np.float64).tobytes())
+    config = {
+        'template': type(lc_template).__name__,
+        'template_hash': template.hexdigest(),
+        'smoothing': getattr(lc_template, 'smoothing', None),
+        'tabulated': getattr(lc_template, 'table', None) is not None,
+        'sigma_int': float(sigma_int),
+        'init': 'xcorr-per-sn',
+        'fitter': 'migrad+hesse',
+    }
+    if settings is not None:
+        config.update(settings)
+    return config
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def fit_key(chash, t_obs, mag_obs, mag_err, redshift):
+    """Hash of a configuration and of the content of one light curve."""
+    key = hashlib.sha256(chash.encode())
+    for arr in (t_obs, mag_obs, mag_err, [redshift]):
+        key.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    return key.hexdigest()
+
+
+class FitCatalog:
+    """
+    Binary table of fit results with per-configuration provenance.
+
+    Results are stored one row per (configuration, supernova); refitting a supernova
+    under the same configuration replaces its row.
+    """
+    def __init__(self, catalog_file=CATALOG_FILE):
+        self.catalog_file = catalog_file
+        if os.path.exists(catalog_file):
+            with np.load(catalog_file) as f:
+                self.table = f['results']
+                self.provenance = json.loads(f['provenance'].tobytes().decode())
+            if self.table.dtype != RESULT_DTYPE:
+                ### Catalog written before failed fits were recorded: all its rows are successful fits
+                table = np.zeros(len(self.table), dtype=RESULT_DTYPE)
+                table['ok'] = True
+                for name in self.table.dtype.names:
+                    table[name] = self.table[name]
+                self.table = table
+        else:
+            self.table = np.zeros(0, dtype=RESULT_DTYPE)
+            self.provenance = {}
+        self._keys = set(self.table['key'].astype(str))
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self.table)
+
+    def add(self, config, rows):
+        """Adds result rows (structured array) fitted with config."""
+        chash = config_hash(config)
+        ### Drop previous results of the same supernovae under this configuration
+        old = (self.table['config'] == chash.encode()) & np.isin(self.table['sn_number'], rows['sn_number'])
+        self.table = np.concatenate([self.table[~old], rows])
+        self._keys = set(self.table['key'].astype(str))
+        prov = self.provenance.setdefault(chash, {'config': config, 'created': time.time()})
+        prov['updated'] = time.time()
+        in_config = self.table['config'] == chash.encode()
+        prov['n_objects'] = int(np.sum(in_config & self.table['ok']))
+        prov['n_failed'] = int(np.sum(in_config & ~self.table['ok']))
+
+    def save(self):
+        tmp_file = self.catalog_file + '.tmp.npz'
+        np.savez(tmp_file, results=self.table,
+                 provenance=np.frombuffer(json.dumps(self.provenance).encode(), dtype=np.uint8))
+        os.replace(tmp_file, self.catalog_file)
+
+    def select(self, **settings):
+        """Configuration hashes whose settings match all the given values (e.g. sigma_int=0.12)."""
+        return [chash for chash, prov in self.provenance.items()
+                if all(prov['config'].get(k) == v for k, v in settings.items())]
+
+    def query(self, config=None, keys=None, failed=False, **settings):
+        """
+        Result rows of one configuration, sorted by supernova number.
+
+        Args:
+            config (dict or str): configuration (see fit_config) or its hash.
+            keys (list): if given, only rows with these fit keys.
+            failed (bool): also return the rows of failed fits (ok = False).
+            settings: alternatively, values identifying a single configuration.
+
+        Returns:
+            numpy.ndarray: structured array with RESULT_DTYPE.
+        """
+        if config is None:
+            matches = self.select(**settings)
+            if len(matches) != 1:
+                raise ValueError(f"{len(matches)} configurations match {settings}: {matches}")
+            config = matches[0]
+        chash = config if isinstance(config, str) else config_hash(config)
+        rows = self.table[self.table['config'] == chash.encode()]
+        if not failed:
+            rows = rows[rows['ok']]
+        if keys is not None:
+            rows = rows[np.isin(rows['key'], np.array(keys, dtype='S64'))]
+        return np.sort(rows, order='sn_number')
+
+
+def fit_with_cache(lc_store, lc_template, sigma_int, catalog_file=CATALOG_FILE, settings=None, verbose=False):
+    """
+    Fits the light curves of lc_store, reusing cached results whose inputs did not change.
+
+    Args:
+        lc_store (LightCurveStore): light curves, redshifts and numbers of the supernovae.
+        lc_template (SNIaLightCurve or SplineLightCurve): template light curve.
+        sigma_int (float): intrinsic scatter added in quadrature to the magnitude errors.
+        catalog_file (str): catalog path.
+        settings (dict): extra fitter settings recorded in (and distinguishing) the configuration.
+        verbose (bool): print per-supernova progress.
+
+    Returns:
+        list: one result dict per successfully fitted supernova, in store order.
+    """
+    config = fit_config(lc_template, sigma_int, settings)
+    chash = config_hash(config)
+    catalog = FitCatalog(catalog_file)
+    keys = [fit_key(chash, *lc_store[i], lc_store.redshift[i]) for i in range(len(lc_store))]
+    todo = [i for i in range(len(keys)) if keys[i] not in catalog]
+    nfailed = int(np.sum(~catalog.query(chash, keys=keys, failed=True)['ok']))
+    print(f"{len(keys) - len(todo)} cached fits ({nfailed} failed), {len(todo)} supernovae to fit (configuration {chash})")
+
+    if todo:
+        rows = []
+        for i in todo:
+            ### Starting point from this light curve alone: the t0 grid of a batch call spans all its
+            ### supernovae, so a cached result would depend on which others were pending with it
+            guesses, _ = xcorr_initial_guess([np.column_stack(lc_store[i])], lc_store.redshift[i:i + 1],
+                                             lc_template, sigma_int=sigma_int)
+            guess = guesses[0]
+            result = fit_supernova_lightcurve(lc_store.sn_number[i], lc_store.redshift[i], lc_template,
+                                              sigma_int, guess=guess, lc_data=lc_store[i])
+            row = np.zeros(1, dtype=RESULT_DTYPE)
+            if result is None:
+                ### Negative entry: not refitted until its inputs change
+                for name in RESULT_COLUMNS:
+                    if row.dtype[name].kind == 'f':
+                        row[name] = np.nan
+                row['sn_number'] = lc_store.sn_number[i]
+                row['redshift'] = lc_store.redshift[i]
+                row['ok'] = False
+            else:
+                for name in RESULT_COLUMNS:
+                    row[name] = result[name]
+                row['ok'] = True
+            row['key'] = keys[i]
+            row['config'] = chash
+            row['fitted_at'] = time.time()
+            rows.append(row)
+            if verbose:
+                if result is None:
+                    print(f"SN-{lc_store.sn_number[i]}: fit failed")
+                else:
+                    print(f"SN-{result['sn_number']}: μ = {result['mu']:.3f} ± {result['mu_err']:.3f}, s = {result['s']:.3f} ± {result['s_err']:.3f}")
+        if rows:
+            catalog.add(config, np.concatenate(rows))
+            catalog.save()
+
+    rows = catalog.query(chash, keys=keys)
+    return [{name: row[name].item() for name in RESULT_COLUMNS} for row in rows]
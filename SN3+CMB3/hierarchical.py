@@ -0,0 +1,179 @@
+import numpy as np
+import emcee
+
+import cosmolib as cs
+from lightcurve import xcorr_initial_guess
+
+# --- Joint light-curve + cosmology likelihood ---
+# Magnitude model of sample j of supernova i:
+#   m_ij = T((t_ij - t0_i) / s_i) - alpha * (s_i - 1) + M + mu(z_i; cosmo) + delta_i
+# with global parameters (omega_M_0, omega_lambda_0, w0, alpha, M, sigma_int) and per-SN
+# nuisances (t0_i, s_i, delta_i), delta_i ~ N(0, sigma_int^2), s_i ~ N(1, sigma_s^2).
+# The nuisances are marginalized with a Laplace approximation around their conditional
+# mode, found by damped Gauss-Newton iterations run simultaneously for all supernovae.
+# The iterations always start from the same reference modes (not from the previous call), so
+# that the likelihood is a fixed function of theta, whatever the order of the calls.
+
+PARAMETERS = ['omega_M_0', 'omega_lambda_0', 'w0', 'alpha', 'M', 'sigma_int']
+
+# Flat prior ranges of the global parameters
+LIMITS = {
+    'omega_M_0': (0., 1.5),
+    'omega_lambda_0': (0., 1.5),
+    'w0': (-3., 0.),
+    'alpha': (-5., 5.),
+    'M': (-2., 2.),
+    'sigma_int': (1e-3, 1.),
+}
+
+
+class HierarchicalSN:
+    """
+    Joint light-curve + cosmology log-likelihood with per-SN nuisances marginalized.
+
+    Args:
+        lc_store (LightCurveStore): light curves and redshifts (see lcstore.py).
+        lc_template (SplineLightCurve): template providing the magnitude and its derivative.
+        h (float): fixed reduced Hubble constant (degenerate with M for supernovae only).
+        sigma_s (float): width of the Gaussian population prior of the stretch around 1.
+        sigma_lc (float): error floor added in quadrature to the photometric errors (template mismatch).
+        niter (int): maximum number of Levenberg-Marquardt iterations per likelihood call.
+        tol (float): convergence threshold on the nuisance steps (self.converged flags each supernova);
+            a call whose nuisance solve has not converged for every supernova returns -inf.
+        limits (dict): flat prior ranges of the global parameters.
+    """
+    def __init__(self, lc_store, lc_template, h=0.7, sigma_s=0.1, sigma_lc=0.12, niter=50, tol=1e-5, limits=LIMITS):
+        self.template = lc_template
+        self.h = h
+        self.sigma_s = sigma_s
+        self.niter = niter
+        self.tol = tol
+        self.limits = limits
+        self.pnames = PARAMETERS
+        self.z = np.asarray(lc_store.redshift, dtype=float)
+        nsn = len(self.z)
+
+        ### Padded (nsn, nmax) arrays of rest-frame times, magnitudes and inverse variances
+        counts = np.diff(lc_store.offsets)
+        sn = np.repeat(np.arange(nsn), counts)
+        col = np.arange(len(sn)) - np.asarray(lc_store.offsets)[sn]
+        shape = (nsn, counts.max())
+        self.t = np.zeros(shape)
+        self.m = np.zeros(shape)
+        self.w = np.zeros(shape)
+        ok = np.isfinite(lc_store.mag) & (lc_store.mag != 0) & (lc_store.err > 0)
+        self.t[sn, col] = lc_store.time / (1 + self.z[sn])
+        self.m[sn, col] = lc_store.mag
+        self.w[sn, col] = np.where(ok, 1. / (lc_store.err**2 + sigma_lc**2), 0.)
+
+        ### Reference nuisance modes [t0, s, delta], starting point of every call
+        guesses, _ = xcorr_initial_guess(lc_store, self.z, lc_template)
+        self.nuisance = np.column_stack([guesses[:, 0], guesses[:, 1], np.zeros(nsn)])
+        self.converged = None
+
+    def set_reference(self, theta):
+        """Starts all later calls from the nuisance modes at theta (e.g. the initial guess of a run)."""
+        p, _, _ = self.solve_nuisances(np.asarray(theta, dtype=float))
+        self.nuisance = p
+        return p
+
+    def cosmo(self, theta):
+        return {'omega_M_0': theta[0], 'omega_lambda_0': theta[1], 'w0': theta[2], 'h': self.h}
+
+    def in_limits(self, theta):
+        for name, val in zip(self.pnames, theta):
+            lo, hi = self.limits[name]
+            if not lo <= val <= hi:
+                return False
+        return True
+
+    def _normal_equations(self, p, alpha, offset, sigma_int):
+        ### Residuals, Gauss-Newton matrix A = J^T W J + prior precision and gradient g
+        t0, s, delta = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+        x = (self.t - t0) / s
+        T, dT = self.template.template(x)
+        r = self.m - (T - alpha * (s - 1) + offset[:, None] + delta)
+        J = np.stack([-dT / s, -dT * x / s - alpha, np.ones_like(x)], axis=-1)
+        wJ = self.w[..., None] * J
+        A = np.einsum('nja,njb->nab', wJ, J)
+        A[:, 1, 1] += 1. / self.sigma_s**2
+        A[:, 2, 2] += 1. / sigma_int**2
+        g = np.einsum('nja,nj->na', wJ, r)
+        g[:, 1] -= (p[:, 1] - 1) / self.sigma_s**2
+        g[:, 2] -= p[:, 2] / sigma_int**2
+        chi2 = (np.sum(self.w * r**2, axis=1) + (p[:, 1] - 1)**2 / self.sigma_s**2
+                + p[:, 2]**2 / sigma_int**2)
+        return A, g, chi2
+
+    def solve_nuisances(self, theta):
+        """Conditional modes of (t0, s, delta) for all supernovae, with Laplace terms."""
+        alpha, M, sigma_int = theta[3], theta[4], theta[5]
+        offset = M + cs.musn1a(self.z, self.cosmo(theta))
+        p = self.nuisance.copy()
+        A, g, chi2 = self._normal_equations(p, alpha, offset, sigma_int)
+        ### Levenberg-Marquardt: one damping factor per supernova, steps kept only if chi2 decreases
+        lam = np.full(len(p), 1e-3)
+        idx = np.arange(3)
+        for it in range(self.niter):
+            Ad = A.copy()
+            Ad[:, idx, idx] *= 1 + lam[:, None]
+            step = np.linalg.solve(Ad, g[..., None])[..., 0]
+            trial = p + step
+            trial[:, 1] = np.clip(trial[:, 1], 0.3, 3.)
+            At, gt, chi2t = self._normal_equations(trial, alpha, offset, sigma_int)
+            better = chi2t <= chi2
+            p[better], A[better], g[better], chi2[better] = trial[better], At[better], gt[better], chi2t[better]
+            lam = np.where(better, lam / 10, lam * 10)
+            self.converged = np.max(np.abs(step), axis=1) < self.tol
+            if np.all(self.converged):
+                break
+        return p, A, chi2
+
+    def __call__(self, theta, extra_args=None, verbose=False):
+        theta = np.asarray(theta, dtype=float)
+        if not self.in_limits(theta):
+            return -np.inf
+        p, A, chi2 = self.solve_nuisances(theta)
+        ### The Laplace terms are only valid at the conditional modes
+        if not np.all(self.converged):
+            return -np.inf
+        sign, logdet = np.linalg.slogdet(A)
+        if np.any(sign <= 0):
+            return -np.inf
+        ### Laplace approximation: -chi2/2 - log det(A)/2, plus the normalization of the delta prior
+        logLLH = np.sum(-0.5 * chi2 - 0.5 * logdet) - len(self.z) * np.log(theta[5])
+        if not np.isfinite(logLLH):
+            return -np.inf
+        return logLLH
+
+    def run_mcmc(self, p0, nbmc=3000, nwalkers=32, scale=1e-3):
+        """emcee run over the global parameters, returns a dict of flat chains."""
+        ndim = len(p0)
+        self.set_reference(p0)
+        pos = np.asarray(p0) + scale * np.random.randn(nwalkers, ndim)
+        sampler = emcee.EnsembleSampler(nwalkers, ndim, self.__call__)
+        ## Burn
+        print('Burning')
+        state = sampler.run_mcmc(pos, nbmc//3, progress=True)
+        sampler.reset()
+        ## sample
+        print('Sampling')
+        sampler.run_mcmc(state, nbmc, progress=True)
+        allchains = sampler.get_chain(flat=True)
+        return {self.pnames[i]: allchains[:, i] for i in range(ndim)}
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    from lcstore import load_light_curve_store
+    from lightcurve import SplineLightCurve
+
+    lc_store = load_light_curve_store()
+    lc_template = SplineLightCurve([lc_store.template_t, lc_store.template_mag])
+    likelihood = HierarchicalSN(lc_store, lc_template)
+
+    # Joint sampling of cosmology, stretch correction, absolute magnitude offset and intrinsic scatter
+    guess = np.array([0.3, 0.7, -1., 1.52, 0., 0.12])
+    chains = likelihood.run_mcmc(guess, nbmc=1000)
+    for name in likelihood.pnames:
+        print(f"{name} = {np.mean(chains[name]):.3f} ± {np.std(chains[name]):.3f}")
@@ -0,0 +1,164 @@
+import os
+import re
+import glob
+import json
+import numpy as np
+
+# Default location of the light-curve files (relative to SN3+CMB3)
+DATA_DIR = os.path.join('data', 'Data-LightCurves')
+
+# --- Binary light-curve store ---
+# One file holding every light curve in a ragged (CSR) layout:
+#   offsets[i]:offsets[i+1] indexes the samples of supernova i in the time/mag/err columns,
+# plus per-object metadata (sn_number, redshift) and the average template light curve.
+# Layout: MAGIC | uint64 header size | JSON header | 64-byte aligned raw arrays.
+# The header records size and mtime of every source file so that a stale store is rebuilt.
+
+MAGIC = b'LCSTORE1'
+ALIGN = 64
+STORE_NAME = 'EI2019-Data-LightCurves.lcstore'
+LC_PATTERN = 'EI2019-Data-LightCurves-SN-*_lightcurve.txt'
+REDSHIFT_NAME = 'EI2019-Data-LightCurves-SN-Redshifts.txt'
+TEMPLATE_NAME = 'EI2019-Data-LightCurves-SN-SNI-Average_LightCurve.txt'
+
+
+def _source_files(data_dir):
+    """Light-curve files sorted by supernova number, plus redshift and template files."""
+    lc_files = {}
+    for filename in glob.glob(os.path.join(data_dir, LC_PATTERN)):
+        match = re.search(r'-SN-(\d+)_lightcurve\.txt$', filename)
+        if match:
+            lc_files[int(match.group(1))] = filename
+    numbers = sorted(lc_files)
+    return numbers, [lc_files[n] for n in numbers], os.path.join(data_dir, REDSHIFT_NAME), os.path.join(data_dir, TEMPLATE_NAME)
+
+
+def _manifest(filenames):
+    manifest = {}
+    for filename in filenames:
+        st = os.stat(filename)
+        manifest[os.path.basename(filename)] = [st.st_size, st.st_mtime_ns]
+    return manifest
+
+
+def ingest_light_curves(data_dir=DATA_DIR, store_file=None):
+    """
+    Packs all light curves, redshifts and the template of data_dir into one binary store.
+
+    Args:
+        data_dir (str): directory with the EI2019 light-curve, redshift and template files.
+        store_file (str): output file, defaults to STORE_NAME inside data_dir.
+
+    Returns:
+        str: path of the written store.
+    """
+    if store_file is None:
+        store_file = os.path.join(data_dir, STORE_NAME)
+    numbers, lc_files, redshift_file, template_file = _source_files(data_dir)
+
+    light_curves = [np.loadtxt(filename, ndmin=2) for filename in lc_files]
+    counts = np.array([len(lc) for lc in light_curves], dtype=np.int64)
+    columns = np.concatenate(light_curves) if light_curves else np.zeros((0, 3))
+    redshifts = np.loadtxt(redshift_file, ndmin=1)
+    template = np.loadtxt(template_file, ndmin=2)
+
+    arrays = {
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'time': np.ascontiguousarray(columns[:, 0], dtype=np.float64),
+        'mag': np.ascontiguousarray(columns[:, 1], dtype=np.float64),
+        'err': np.ascontiguousarray(columns[:, 2], dtype=np.float64),
+        'sn_number': np.array(numbers, dtype=np.int64),
+        # Redshifts are indexed by supernova number
+        'redshift': np.asarray(redshifts[numbers], dtype=np.float64),
+        'template_t': np.ascontiguousarray(template[:, 0], dtype=np.float64),
+        'template_mag': np.ascontiguousarray(template[:, 1], dtype=np.float64),
+    }
+
+    ### Header with byte offsets relative to the start of the data section
+    layout = {}
+    pos = 0
+    for name, arr in arrays.items():
+        layout[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': pos}
+        pos += -(-arr.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        'version': 1,
+        'arrays': layout,
+        'sources': _manifest(lc_files + [redshift_file, template_file]),
+    }).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+    header += b' ' * (start - len(MAGIC) - 8 - len(header))
+
+    ### Write to a temporary file first so that readers never see a partial store
+    tmp_file = store_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(start + layout[name]['offset'])
+            f.write(arr.tobytes())
+        f.truncate(start + pos)
+    os.replace(tmp_file, store_file)
+    return store_file
+
+
+class LightCurveStore:
+    """
+    Memory-mapped view of a store written by ingest_light_curves.
+
+    store[i] returns (time, mag, err) of the i-th supernova as zero-copy views of the
+    file; the full columns, offsets and metadata are available as attributes.
+    """
+    def __init__(self, store_file):
+        self.store_file = store_file
+        with open(store_file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{store_file} is not a light-curve store")
+            size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(size))
+        start = len(MAGIC) + 8 + size
+        raw = np.memmap(store_file, dtype=np.uint8, mode='r')
+        for name, spec in self.header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            begin = start + spec['offset']
+            setattr(self, name, raw[begin:begin + count * dtype.itemsize].view(dtype).reshape(spec['shape']))
+
+    def __len__(self):
+        return len(self.sn_number)
+
+    def __getitem__(self, i):
+        sl = slice(self.offsets[i], self.offsets[i + 1])
+        return self.time[sl], self.mag[sl], self.err[sl]
+
+    def is_stale(self, data_dir):
+        """True if the source files of data_dir differ from the ones the store was built from."""
+        numbers, lc_files, redshift_file, template_file = _source_files(data_dir)
+        try:
+            manifest = _manifest(lc_files + [redshift_file, template_file])
+        except FileNotFoundError:
+            return True
+        return manifest != self.header['sources']
+
+
+def load_light_curve_store(data_dir=DATA_DIR, store_file=None, rebuild=False):
+    """
+    Opens the binary light-curve store of data_dir, (re)building it if missing or stale.
+
+    Args:
+        data_dir (str): directory with the EI2019 light-curve files.
+        store_file (str): store path, defaults to STORE_NAME inside data_dir.
+        rebuild (bool): force a new ingest.
+
+    Returns:
+        LightCurveStore: memory-mapped store.
+    """
+    if store_file is None:
+        store_file = os.path.join(data_dir, STORE_NAME)
+    if not rebuild and os.path.exists(store_file):
+        store = LightCurveStore(store_file)
+        if not store.is_stale(data_dir):
+            return store
+        del store
+    ingest_light_curves(data_dir, store_file=store_file)
+    return LightCurveStore(store_file)
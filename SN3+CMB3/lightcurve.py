@@ -0,0 +1,306 @@
+import os
+import numpy as np
+from scipy.interpolate import interp1d, UnivariateSpline
+from scipy import fft as sfft
+
+import cosmolib as cs
+from lcstore import DATA_DIR
+
+# Arbitrary cosmological parameters to initialize mu_guess
+cosmo_pars = {'h': 0.7, 'omega_M_0': 0.5, 'omega_lambda_0': 0.5, 'w0': -1}
+
+
+def light_curve_file(sn_number, data_dir=DATA_DIR):
+    """Path of the light-curve file of supernova sn_number."""
+    return os.path.join(data_dir, f'EI2019-Data-LightCurves-SN-{sn_number}_lightcurve.txt')
+
+
+# Interpolation model for SNIa lightcurve
+class SNIaLightCurve:
+    def __init__(self, template_data):
+        self.template_t = template_data[0]
+        self.template_mag = template_data[1]
+        self.interpolator = interp1d(
+            self.template_t,
+            self.template_mag,
+            kind='linear',
+            fill_value='extrapolate',
+            bounds_error=False
+        )
+
+    def __call__(self, t, pars):
+        # pars : [t0, s, mu] where:
+        # t0 : time of maximum brightness
+        # s : stretch parameter (brighter-slower effect)
+        # mu : distance modulus
+        t0, s, mu = pars
+
+        # Apply time stretch and shift
+        t_stretched = (t - t0) / s
+
+        # Interpolate template at stretched times using scipy interpolator
+        mag_intrinsic = self.interpolator(t_stretched)
+
+        # Apply brighter-slower correction: -1.52*(s-1) and add distance modulus
+        mag_observed = mag_intrinsic - 1.52*(s-1) + mu
+
+        return mag_observed
+
+
+# Smoothing-spline model for SNIa lightcurve with analytic derivatives
+class SplineLightCurve:
+    """
+    SNIa template backed by a cubic smoothing spline, with analytic gradient.
+
+    Same call convention as SNIaLightCurve: model(t, [t0, s, mu]). Outside of the
+    template time range the template is held at its end values (zero slope) instead
+    of being extrapolated. If svals is given, the model and its derivatives are
+    tabulated once on a regular (t - t0, s) grid and every evaluation becomes a
+    vectorized bilinear lookup (s is clamped to the tabulated range).
+
+    Args:
+        template_data (list): [time, absolute_magnitude] of the average light curve.
+        smoothing (float): rms residual (mag) allowed between spline and template.
+        svals (array): stretch grid of the optional precomputed table.
+        dt (float): t - t0 step of the optional precomputed table (days).
+    """
+    def __init__(self, template_data, smoothing=0.005, svals=None, dt=0.05):
+        self.template_t = np.asarray(template_data[0], dtype=float)
+        self.template_mag = np.asarray(template_data[1], dtype=float)
+        self.smoothing = smoothing
+        self.spline = UnivariateSpline(self.template_t, self.template_mag, k=3,
+                                       s=len(self.template_t) * smoothing**2)
+        self.dspline = self.spline.derivative()
+        self.tmin = self.template_t[0]
+        self.tmax = self.template_t[-1]
+        self.table = None
+        if svals is not None:
+            self.tabulate(svals, dt=dt)
+
+    def template(self, x):
+        """Template magnitude and its derivative at (stretched) times x."""
+        xc = np.clip(x, self.tmin, self.tmax)
+        inside = (x >= self.tmin) & (x <= self.tmax)
+        return self.spline(xc), self.dspline(xc) * inside
+
+    def tabulate(self, svals, dt=0.05):
+        """
+        Precompute model offset M(t - t0, s) and its derivatives on a regular grid.
+
+        Raises:
+            ValueError: fewer than two stretches, or stretches not increasing evenly spaced.
+        """
+        svals = np.asarray(svals, dtype=float)
+        if svals.ndim != 1 or len(svals) < 2:
+            raise ValueError("tabulate needs at least two stretch values")
+        ds = np.diff(svals)
+        if ds[0] <= 0 or not np.allclose(ds, ds[0], rtol=1e-6, atol=0):
+            raise ValueError("stretch values must be increasing and evenly spaced")
+        tau = np.arange(self.tmin * svals.max(), self.tmax * svals.max() + dt, dt)
+        x = tau[None, :] / svals[:, None]
+        T, dT = self.template(x)
+        self.table = {
+            'tau0': tau[0], 'dtau': dt, 's0': svals[0], 'ds': svals[1] - svals[0],
+            'M': T - 1.52 * (svals[:, None] - 1),
+            'dM_dtau': dT / svals[:, None],
+            'dM_ds': -dT * x / svals[:, None] - 1.52,
+        }
+
+    def _lookup(self, tau, s, derivs=True):
+        ### Bilinear weights on the (s, tau) table, clamped to its edges
+        tab = self.table
+        ns, nt = tab['M'].shape
+        fs = np.clip((s - tab['s0']) / tab['ds'], 0, ns - 1)
+        ft = (tau - tab['tau0']) / tab['dtau']
+        inside = (ft >= 0) & (ft <= nt - 1)
+        ft = np.clip(ft, 0, nt - 1)
+        i = np.minimum(int(fs), ns - 2)
+        j = np.minimum(ft.astype(int), nt - 2)
+        ws = fs - i
+        wt = ft - j
+        def interp(arr):
+            return ((1 - ws) * ((1 - wt) * arr[i, j] + wt * arr[i, j + 1])
+                    + ws * ((1 - wt) * arr[i + 1, j] + wt * arr[i + 1, j + 1]))
+        if not derivs:
+            return interp(tab['M'])
+        return interp(tab['M']), interp(tab['dM_dtau']) * inside, interp(tab['dM_ds'])
+
+    def _offset(self, t, t0, s, derivs=True):
+        ### Model without mu (and its derivatives w.r.t. t - t0 and s)
+        if self.table is not None:
+            return self._lookup(np.asarray(t, dtype=float) - t0, s, derivs=derivs)
+        x = (np.asarray(t, dtype=float) - t0) / s
+        if not derivs:
+            return self.spline(np.clip(x, self.tmin, self.tmax)) - 1.52 * (s - 1)
+        T, dT = self.template(x)
+        return T - 1.52 * (s - 1), dT / s, -dT * x / s - 1.52
+
+    def __call__(self, t, pars):
+        t0, s, mu = pars
+        return self._offset(t, t0, s, derivs=False) + mu
+
+    def grad(self, t, pars):
+        """Analytic derivatives (3, len(t)) of the model w.r.t. [t0, s, mu]."""
+        t0, s, mu = pars
+        M, dM_dtau, dM_ds = self._offset(t, t0, s)
+        return np.array([-dM_dtau, dM_ds, np.ones_like(M)])
+
+
+###############################################################################
+############################ Initial guesses ##################################
+###############################################################################
+def xcorr_initial_guess(light_curves, redshifts, lc_template, svals=None, dt=0.25,
+                        t0_margin=10., sigma_int=0., chunk=256):
+    """
+    Vectorized (t0, s, mu) starting points for the light-curve fits.
+
+    All light curves are binned (nearest sample) onto a common rest-frame time
+    grid of step dt. For every stretch in svals and every t0 on the same grid,
+    the chi2 of the template with mu minimized analytically is obtained from
+    three FFT cross-correlations (weights x T, weighted mags x T, weights x T^2),
+    computed for all supernovae at once. The template is clamped to its end
+    values outside of its time range.
+
+    Args:
+        light_curves (list or LightCurveStore): (N_i, 3) arrays of (observed time, magnitude, error),
+                                                or a binary light-curve store (see lcstore.py).
+        redshifts (array): redshift of each light curve.
+        lc_template (SNIaLightCurve or SplineLightCurve): template light curve.
+        svals (array): stretch grid, defaults to 0.7 ... 1.3.
+        dt (float): step of the rest-frame time and t0 grids (days).
+        t0_margin (float): t0 is scanned over the data time span widened by this margin (days).
+        sigma_int (float): intrinsic scatter added in quadrature to the errors.
+        chunk (int): number of supernovae correlated per FFT batch (bounds memory).
+
+    Returns:
+        tuple: (guesses, chi2)
+               guesses (numpy.ndarray): (nsn, 3) array of [t0, s, mu] for each supernova.
+               chi2 (numpy.ndarray): chi2 of the best grid point for each supernova.
+    """
+    if svals is None:
+        svals = np.linspace(0.7, 1.3, 25)
+    svals = np.atleast_1d(np.asarray(svals, dtype=float))
+    redshifts = np.atleast_1d(np.asarray(redshifts, dtype=float))
+    nsn = len(light_curves)
+
+    ### Samples of all SNe concatenated (the CSR store already holds them that way)
+    if hasattr(light_curves, 'offsets'):
+        t_all, m_all, e_all = light_curves.time, light_curves.mag, light_curves.err
+        sn_all = np.repeat(np.arange(nsn), np.diff(light_curves.offsets))
+    else:
+        lcs = [np.asarray(lc) for lc in light_curves]
+        t_all, m_all, e_all = np.concatenate(lcs).T
+        sn_all = np.repeat(np.arange(nsn), [len(lc) for lc in lcs])
+
+    ### Rest-frame times and weights, truncated points (mag = 0) removed
+    ok = np.isfinite(m_all) & (m_all != 0) & (e_all > 0)
+    sn_all = sn_all[ok]
+    t_all = t_all[ok] / (1 + redshifts[sn_all])
+    m_all = m_all[ok]
+    w_all = 1. / (e_all[ok]**2 + sigma_int**2)
+
+    ### Common data grid u_k = tmin + k*dt and t0 grid t0_j = t0lo + j*dt
+    tmin, tmax = np.min(t_all), np.max(t_all)
+    K = int(np.ceil((tmax - tmin) / dt)) + 1
+    t0lo = tmin - t0_margin
+    J = int(np.ceil((tmax - tmin + 2 * t0_margin) / dt)) + 1
+    L = K + J - 1
+
+    ### Binning of weights, weighted magnitudes and weighted squared magnitudes
+    flat = sn_all * K + np.rint((t_all - tmin) / dt).astype(int)
+    W = np.bincount(flat, weights=w_all, minlength=nsn * K).reshape(nsn, K)
+    WM = np.bincount(flat, weights=w_all * m_all, minlength=nsn * K).reshape(nsn, K)
+    S_w = W.sum(axis=1)
+    S_m = WM.sum(axis=1)
+    S_mm = np.bincount(sn_all, weights=w_all * m_all**2, minlength=nsn)
+
+    ### Template kernels h_s[n] = T_s(tmin - t0lo + (n - J + 1)*dt), n = 0 ... L-1
+    x = tmin - t0lo + (np.arange(L) - (J - 1)) * dt
+    h = np.interp(x[None, :] / svals[:, None], lc_template.template_t, lc_template.template_mag)
+    h -= 1.52 * (svals[:, None] - 1)
+
+    ### c[tau] = sum_k W_k h[k + tau] for tau = J-1-j, no wrap-around for P >= K + L
+    P = sfft.next_fast_len(K + L, real=True)
+    Fh = sfft.rfft(h, n=P, axis=-1)
+    Fh2 = sfft.rfft(h**2, n=P, axis=-1)
+
+    guesses = np.zeros((nsn, 3))
+    chi2 = np.zeros(nsn)
+    for i0 in range(0, nsn, chunk):
+        sl = slice(i0, min(i0 + chunk, nsn))
+        FW = np.conj(sfft.rfft(W[sl], n=P, axis=-1))[:, None, :]
+        FWM = np.conj(sfft.rfft(WM[sl], n=P, axis=-1))[:, None, :]
+        A = sfft.irfft(FW * Fh, n=P, axis=-1)[..., :J]
+        B = sfft.irfft(FWM * Fh, n=P, axis=-1)[..., :J]
+        C = sfft.irfft(FW * Fh2, n=P, axis=-1)[..., :J]
+        sw = S_w[sl, None, None]
+        sm = S_m[sl, None, None]
+        ch2 = S_mm[sl, None, None] - 2 * B + C - (sm - A)**2 / sw
+        ### Best (s, tau) for each supernova
+        best = np.argmin(ch2.reshape(ch2.shape[0], -1), axis=1)
+        ibest, tbest = np.unravel_index(best, (len(svals), J))
+        rows = np.arange(ch2.shape[0])
+        guesses[sl, 0] = t0lo + (J - 1 - tbest) * dt
+        guesses[sl, 1] = svals[ibest]
+        guesses[sl, 2] = ((sm[:, 0, 0] - A[rows, ibest, tbest]) / sw[:, 0, 0])
+        chi2[sl] = ch2[rows, ibest, tbest]
+    return guesses, chi2
+###############################################################################
+###############################################################################
+
+
+# Function to fit individual supernova
+def fit_supernova_lightcurve(sn_number, redshift, lc_template, sigma_int, verbose=False, guess=None,
+                             data_dir=DATA_DIR, lc_data=None):
+
+    if lc_data is None:
+        # Load supernova data
+        filename = light_curve_file(sn_number, data_dir=data_dir)
+        if not os.path.exists(filename):
+            return None
+        data = np.loadtxt(filename)
+        lc_data = data[:, 0], data[:, 1], data[:, 2]
+
+    t_obs, mag_obs, mag_err = lc_data  # observed time, magnitude and magnitude errors
+
+    # Add intrinsic error in quadrature
+    total_mag_err = np.sqrt(mag_err**2 + sigma_int**2)
+
+    # Convert to rest frame time
+    t_rest = t_obs / (1 + redshift)
+
+    if guess is None:
+        # Initial guess: t0=reasonable time of maximum brightness, s=1, mu=reasonable distance modulus for the redshift
+        t0_guess = t_rest[np.argmin(mag_obs)]
+        mu_guess = cs.musn1a(redshift, cosmo_pars)
+
+        # Initial guess = [t0, s, mu]
+        guess = np.array([t0_guess, 1.0, mu_guess])
+
+    try:
+        # Fit using Minuit with total error (including intrinsic scatter)
+        # Analytic model gradient when the template provides one (SplineLightCurve)
+        result = cs.do_minuit(t_rest, mag_obs, total_mag_err, np.asarray(guess, dtype=float),
+                             functname=lc_template, verbose=verbose,
+                             grad=getattr(lc_template, 'grad', None))
+
+        fitm, fitted_values, errors, covariance, chi2, ndf = result
+
+        return {
+            'sn_number': sn_number,
+            'redshift': redshift,
+            't0': fitted_values[0],
+            't0_err': errors[0],
+            's': fitted_values[1],
+            's_err': errors[1],
+            'mu': fitted_values[2],
+            'mu_err': errors[2],
+            'chi2': chi2,
+            'ndf': ndf,
+            'chi2_reduced': chi2/ndf if ndf > 0 else np.inf,
+            'sigma_int_used': sigma_int
+        }
+    except Exception as e:
+        if verbose:
+            print(f"Fitting failed for SN-{sn_number}: {e}")
+        return None
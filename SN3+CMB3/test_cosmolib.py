@@ -0,0 +1,32 @@
+# Checks of cosmolib fitting tools. Run from the repository root: python -m pytest SN3+CMB3
+import numpy as np
+
+import cosmolib as cs
+
+
+def sn_data(nsn=150, seed=42):
+    ### Mock Hubble diagram (flat LCDM) with an absolute magnitude offset, fitted with the offset profiled
+    rng = np.random.default_rng(seed)
+    z = np.sort(rng.uniform(0.01, 1.0, nsn))
+    err = np.full(nsn, np.sqrt(0.15**2 + 0.12**2))
+    mu = cs.musn1a(z, {'omega_M_0': 0.3, 'omega_lambda_0': 0.7, 'w0': -1, 'h': 0.7}) + 0.3 + rng.normal(0, 1, nsn) * err
+
+    def model(z, p):
+        return cs.musn1a(z, {'omega_M_0': p[0], 'omega_lambda_0': p[1], 'w0': p[2], 'h': 0.7})
+    return cs.Data(z, mu, err, model, pnames=['om', 'ol', 'w0'], marg_offset=True)
+
+
+def test_profile_scan_matches_independent_fits():
+    ### Every point of a 2-D scan (w0 profiled) is at least as good as a fit started from the best fit
+    data = sn_data()
+    om = np.linspace(0.1, 0.6, 6)
+    ol = np.linspace(0.4, 1.0, 7)
+    with np.errstate(over='ignore', invalid='ignore'):
+        scan = data.profile_scan([0.3, 0.7, -1.], [0, 1], [om, ol])
+        for i, a in enumerate(om):
+            for j, b in enumerate(ol):
+                m = cs._profile_minuit(data, np.array([a, b, scan['bestfit'][2]]), [0, 1], None)
+                m.migrad()
+                assert scan['chi2'][i, j] <= m.fval + 1e-2
+    assert np.all(scan['valid'])
+    assert np.min(scan['dchi2']) >= -1e-6
@@ -0,0 +1,47 @@
+# Checks of the hierarchical likelihood on the light curves of data/. Run from the repository root: python -m pytest SN3+CMB3
+import os
+import pickle
+import numpy as np
+
+from lcstore import load_light_curve_store
+from lightcurve import SplineLightCurve
+from hierarchical import HierarchicalSN
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'Data-LightCurves')
+
+GUESS = np.array([0.3, 0.7, -1., 1.52, 0., 0.12])
+
+
+def make_likelihood(tmp_path, **kwargs):
+    lc_store = load_light_curve_store(DATA_DIR, store_file=str(tmp_path / 'lc.lcstore'))
+    lc_template = SplineLightCurve([lc_store.template_t, lc_store.template_mag])
+    likelihood = HierarchicalSN(lc_store, lc_template, **kwargs)
+    likelihood.set_reference(GUESS)
+    return likelihood
+
+
+def test_repeated_calls_identical(tmp_path):
+    ### The likelihood at one theta must not depend on the calls made before (emcee needs a fixed target)
+    likelihood = make_likelihood(tmp_path)
+    first = likelihood(GUESS)
+    rng = np.random.default_rng(0)
+    for theta in GUESS + 0.02 * rng.normal(size=(20, len(GUESS))):
+        likelihood(theta)
+    assert np.isfinite(first)
+    assert likelihood(GUESS) == first
+
+
+def test_pickled_copy_identical(tmp_path):
+    ### Copies sent to pool workers give the same values as the original
+    likelihood = make_likelihood(tmp_path)
+    copy = pickle.loads(pickle.dumps(likelihood))
+    theta = GUESS + 0.01
+    likelihood(GUESS - 0.01)
+    assert copy(theta) == likelihood(theta)
+
+
+def test_unconverged_solve_rejected(tmp_path):
+    ### A nuisance solve stopped before convergence gives no likelihood value
+    likelihood = make_likelihood(tmp_path, niter=1)
+    assert not np.all(likelihood.converged)
+    assert likelihood(GUESS) == -np.inf
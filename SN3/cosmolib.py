@@ -1,17 +1,23 @@
-from pylab import *
+import sys
+import time
+import json
 import numpy as np
-import scipy.integrate
-import numpy as np
-from matplotlib import *
-from matplotlib.pyplot import *
-from scipy.ndimage import gaussian_filter1d
-from scipy import integrate
-from scipy import interpolate
-from scipy import ndimage
-import scipy.stats as st
-import emcee
-import iminuit
-from iminuit.cost import LeastSquares
+
+### Headless numeric core: importing cosmolib only imports numpy.
+### iminuit, emcee and scipy are imported by the functions that need them, and the plotting
+### functions (matrixplot, cont, grid_cont, getcols) live in cosmoplot.py, loaded on first
+### access as cosmolib attributes (cs.matrixplot still works).
+_PLOTTING = ['matrixplot', 'getcols', 'cont', 'grid_cont']
+
+def __getattr__(name):
+    if name in _PLOTTING:
+        import cosmoplot
+        return getattr(cosmoplot, name)
+    raise AttributeError("module 'cosmolib' has no attribute '{}'".format(name))
+
+### Same as scipy.integrate.cumulative_trapezoid
+def _cumtrapz(y, x):
+    return np.cumsum(np.diff(x) * (y[1:] + y[:-1]) / 2.0)
 
 
 
@@ -46,7 +52,7 @@ def propdist(z,cosmo,zres=0.001,accurate=False):
     zvals=np.linspace(0.,zmax,nb)
     ### integrate
     cumulative=np.zeros(int(nb))
-    cumulative[1:]=scipy.integrate.cumulative_trapezoid(1./e_z(zvals,cosmo),zvals)
+    cumulative[1:]=_cumtrapz(1./e_z(zvals,cosmo),zvals)
     ### interpolation to input z values
     propdist=np.interp(z,zvals,cumulative)
     ### curvature
@@ -73,6 +79,11 @@ def angdist(z,cosmo,zres=0.001,accurate=False):
 def musn1a(z, cosmo):
     dlum = lumdist(z, cosmo)*1e6
     return(5*np.log10(dlum)-5+5*np.log10(cosmo['h']/0.7))
+
+### SNIa distance modulus up to an additive constant, pars = [omega_M_0, omega_lambda_0, w0]
+### (h only shifts mu: use with Data(..., marg_offset=True) which marginalizes that shift)
+def musn1a_shape(z, pars):
+    return musn1a(z, {'omega_M_0': pars[0], 'omega_lambda_0': pars[1], 'w0': pars[2], 'h': 0.7})
 ### Age
 def lookback(z,cosmo,zres=0.001):
     ### z range for integration
@@ -84,7 +95,7 @@ def lookback(z,cosmo,zres=0.001):
     zvals=np.linspace(0.,zmax,nb)
     ### integrate
     cumulative=np.zeros(int(nb))
-    cumulative[1:]=scipy.integrate.cumulative_trapezoid(1./e_z(zvals,cosmo)/(1+zvals),zvals)
+    cumulative[1:]=_cumtrapz(1./e_z(zvals,cosmo)/(1+zvals),zvals)
     ### interpolation to input z values
     age=np.interp(z,zvals,cumulative)
     ### Age in Gyr
@@ -111,9 +122,9 @@ def rs(cosmo,zd=1059.25):
 def RR(z,ob,h,theta):
     return(31.492*ob*h**2*theta**(-4)*((1+z)/1000)**(-1))
 
-def thetastar(cosmo,zstar=1090.49):
+def thetastar(cosmo,zstar=1090.49,zres=0.001):
         rsval=rs(cosmo,zd=zstar)
-        da=angdist(zstar,cosmo,zres=0.001)
+        da=angdist(zstar,cosmo,zres=zres)
         return rsval/(1+zstar)/da
         
 ###############################################################################
@@ -123,21 +134,109 @@ def thetastar(cosmo,zstar=1090.49):
 ###############################################################################
 ########################## Miscellaneous Functions ############################
 ###############################################################################
-def progress_bar(i,n):
+def progress_bar(i,n,info=''):
     if n != 1:
         ntot=50
-        ndone=ntot*i/(n-1)
+        ndone=int(ntot*i/(n-1))
         a='\r|'
         for k in range(ndone):
             a += '#'
         for k in range(ntot-ndone):
             a += ' '
-        a += '| '+str(int(i*100./(n-1)))+'%'
+        a += '| '+str(int(i*100./(n-1)))+'% '+info
         sys.stdout.write(a)
         sys.stdout.flush()
         if i == n-1:
             sys.stdout.write(' Done \n')
             sys.stdout.flush()
+
+### Instrumentation of the likelihoods: number and time of the model evaluations per dataset,
+### rejected (-inf) evaluations, hit rate of models with an lru_cache, and sampler throughput
+### (evaluations/s, ETA, acceptance fraction, autocorrelation time) printed and/or logged as JSON lines.
+### Enabled with Data.enable_telemetry(); when disabled, Data does not touch it at all.
+### Instrumented Data objects can be pickled (emcee pool): each worker then counts in its own
+### copy, and the throughput is taken from the sampler steps.
+class TimedModel:
+    ### Model wrapper adding the number and time of its evaluations to stats
+    def __init__(self, model, stats):
+        self.untimed = model
+        self.stats = stats
+
+    def __call__(self, x, pars):
+        t0 = time.perf_counter()
+        val = self.untimed(x, pars)
+        self.stats['t_model'] += time.perf_counter() - t0
+        self.stats['n_model'] += 1
+        return val
+
+
+class Telemetry:
+    def __init__(self, log_file=None, every=100, console=True):
+        self.log_file = log_file
+        self.every = every
+        self.console = console
+        self.stats = {}
+        self.start()
+
+    def start(self):
+        self.tstart = time.perf_counter()
+        self.n0 = self.ncalls()
+
+    def ncalls(self):
+        ### likelihood evaluations (each one goes through all the datasets)
+        return np.max([st['n_call'] for st in self.stats.values()]) if self.stats else 0
+
+    def register(self, name, model):
+        self.stats[name] = {'n_model': 0, 't_model': 0., 'n_call': 0, 't_call': 0., 'n_reject': 0}
+        return TimedModel(model, self.stats[name])
+
+    def timed_call(self, name, loglike, theta, verbose=False):
+        stats = self.stats[name]
+        t0 = time.perf_counter()
+        val = loglike(theta, verbose=verbose)
+        stats['t_call'] += time.perf_counter() - t0
+        stats['n_call'] += 1
+        if not np.isfinite(val):
+            stats['n_reject'] += 1
+        return val
+
+    def summary(self, models=None):
+        ### Per dataset counters (with the lru_cache statistics of the models that have one)
+        out = {}
+        for name, st in self.stats.items():
+            out[name] = dict(st)
+            out[name]['ms_per_model'] = 1e3*st['t_model']/max(st['n_model'], 1)
+            out[name]['reject_fraction'] = st['n_reject']/max(st['n_call'], 1)
+            if models is not None and hasattr(models.get(name), 'cache_info'):
+                ci = models[name].cache_info()
+                out[name]['cache_hit_rate'] = ci.hits/max(ci.hits + ci.misses, 1)
+        return out
+
+    def sampler_step(self, sampler, i, n, models=None):
+        ### Called after each step of emcee, emits throughput statistics every self.every steps
+        if (i + 1) % self.every != 0 and i != n - 1:
+            return
+        elapsed = time.perf_counter() - self.tstart
+        if getattr(sampler, 'pool', None) is None:
+            nevals = self.ncalls() - self.n0
+        else:
+            ### evaluations happen in the workers: one per walker and step
+            nevals = (i + 1)*sampler.nwalkers
+        record = {'step': i + 1, 'nsteps': n, 'elapsed': elapsed,
+                  'evals_per_s': nevals/elapsed if elapsed > 0 else 0.,
+                  'eta': elapsed/(i + 1)*(n - i - 1),
+                  'acceptance': float(np.mean(sampler.acceptance_fraction)),
+                  'tau': np.nan_to_num(sampler.get_autocorr_time(tol=0)).tolist(),
+                  'datasets': self.summary(models)}
+        if self.console:
+            progress_bar(i, n, info='{0:.0f} evals/s, ETA {1:.0f}s, acc {2:.2f}, tau {3:.1f}'.format(
+                record['evals_per_s'], record['eta'], record['acceptance'], np.max(record['tau'])))
+        if self.log_file is not None:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(record)+'\n')
+        return record
+
+
 ###############################################################################
 ###############################################################################
             
@@ -148,7 +247,7 @@ def progress_bar(i,n):
 ########################## Fitting Class (minuit & MCMC) ################
 ###############################################################################
 class Data:
-    def __init__(self, x, y, cov, model, pnames=None):
+    def __init__(self, x, y, cov, model, pnames=None, marg_offset=False, free_scatter=False, scatter_bins=None):
         self.x = x
         self.y = y
         self.model = model
@@ -165,6 +264,27 @@ class Data:
         self.fitinfo = None
         self.pnames = pnames
         self.fixedpars = None
+        self.telemetry = None
+        ### Analytic marginalization over an additive offset of the model (flat prior),
+        ### e.g. the SNIa absolute magnitude / H0 degeneracy: with u = C^-1 1 and S = 1^T C^-1 1,
+        ### -2 log L = r^T C^-1 r - (u^T r)^2 / S + log S, r being the residuals without offset
+        self.marg_offset = marg_offset
+        self.offset = 0.
+        if marg_offset:
+            self.invcov_one = self.invcov @ np.ones(len(self.y))
+            self.sum_invcov = np.sum(self.invcov_one)
+        ### Free intrinsic scatter: C = cov + diag(sigma_int^2), sigma_int being the last parameter(s)
+        ### (one per bin of x if scatter_bins gives bin edges), and the likelihood includes -0.5 log det C
+        self.nscatter = 0
+        if free_scatter or scatter_bins is not None:
+            if scatter_bins is None:
+                self.scatter_index = np.zeros(len(self.x), dtype=int)
+                self.nscatter = 1
+            else:
+                self.nscatter = len(scatter_bins) - 1
+                self.scatter_index = np.clip(np.digitize(self.x, scatter_bins) - 1, 0, self.nscatter - 1)
+            if self.diag:
+                self.var = np.asarray(self.errors, dtype=float)**2
         
     def __call__(self, mytheta, extra_args=None, verbose=False):
         if self.fixedpars is not None:
@@ -173,7 +293,31 @@ class Data:
         else:
             theta = mytheta
         # theta = mytheta
-        self.modelval = self.model(self.x, theta)
+        if self.telemetry is not None:
+            return self.telemetry.timed_call(self.name, self.loglike, theta, verbose=verbose)
+        return self.loglike(theta, verbose=verbose)
+
+    def enable_telemetry(self, telemetry=None, name='data', **kwargs):
+        ### Counts and times the model and likelihood evaluations (see Telemetry)
+        if telemetry is None:
+            telemetry = Telemetry(**kwargs)
+        self.disable_telemetry()
+        self.telemetry = telemetry
+        self.name = name
+        self.model = telemetry.register(name, self.model)
+        return telemetry
+
+    def disable_telemetry(self):
+        if self.telemetry is not None:
+            self.model = self.model.untimed
+        self.telemetry = None
+
+    def telemetry_models(self):
+        return {self.name: self.model.untimed}
+
+    def loglike(self, theta, verbose=False):
+        ### Log-likelihood at the full parameter vector theta
+        self.modelval = self.model(self.x, theta[:len(theta)-self.nscatter])
 
         if verbose:
             print('Pars')
@@ -190,13 +334,22 @@ class Data:
             print('Diff x invcov')
             print(np.shape((self.y - self.modelval).T @ self.invcov))
             print(((self.y - self.modelval).T @ self.invcov)[0:10])
-        logLLH = - 0.5 * (((self.y - self.modelval).T @ self.invcov) @ (self.y - self.modelval))
+        if self.nscatter:
+            return self.loglike_scatter(theta, modelval=self.modelval)
+        resid = self.y - self.modelval
+        logLLH = - 0.5 * ((resid.T @ self.invcov) @ resid)
+        if self.marg_offset:
+            ### Best offset given theta, and the Gaussian integral over the offset
+            b = self.invcov_one @ resid
+            self.offset = b / self.sum_invcov
+            logLLH += 0.5 * b * self.offset - 0.5 * np.log(self.sum_invcov)
         if not np.isfinite(logLLH):
             return -np.inf
         else:
             return logLLH
 
     def plot(self, nn=1000, color=None, mylabel=None, nostat=False):
+        from matplotlib.pyplot import errorbar, plot, legend
         p=errorbar(self.x, self.y, yerr=self.errors, fmt='o', color=color, alpha=1)
         if self.fit is not None:
             xx = np.linspace(np.min(self.x), np.max(self.x), nn)
@@ -208,15 +361,172 @@ class Data:
             legend()
 
 
-    def fit_minuit(self, guess, fixpars = None, limits=None, scan=None, renorm=False, simplex=False, minimizer=LeastSquares):
+    def sample(self, sampler, state, nsteps):
+        if self.telemetry is None:
+            return sampler.run_mcmc(state, nsteps, progress=True)
+        ### Same steps, with the telemetry reporting throughput as it goes
+        self.telemetry.start()
+        models = self.telemetry_models()
+        for i, state in enumerate(sampler.sample(state, iterations=nsteps)):
+            self.telemetry.sampler_step(sampler, i, nsteps, models=models)
+        return state
+
+    def loglike_scatter(self, theta, modelval=None):
+        ### Log-likelihood with the intrinsic scatter as free parameters (theta ends with them)
+        ### Diagonal case: O(N) update of the variances, no matrix inversion
+        ### modelval: model already computed at theta (by loglike), not computed again
+        sig = np.asarray(theta[len(theta)-self.nscatter:], dtype=float)
+        if np.any(sig < 0):
+            return -np.inf
+        self.modelval = self.model(self.x, theta[:len(theta)-self.nscatter]) if modelval is None else modelval
+        resid = self.y - self.modelval
+        if self.diag:
+            w = 1. / (self.var + sig[self.scatter_index]**2)
+            logLLH = - 0.5 * (np.sum(w * resid**2) - np.sum(np.log(w)))
+            if self.marg_offset:
+                b = np.sum(w * resid)
+                S = np.sum(w)
+                self.offset = b / S
+                logLLH += 0.5 * b * self.offset - 0.5 * np.log(S)
+        else:
+            import scipy.linalg
+            cov = self.cov + np.diag(sig[self.scatter_index]**2)
+            try:
+                cf = scipy.linalg.cho_factor(cov)
+            except np.linalg.LinAlgError:
+                return -np.inf
+            logdet = 2 * np.sum(np.log(np.diag(cf[0])))
+            logLLH = - 0.5 * (resid @ scipy.linalg.cho_solve(cf, resid) + logdet)
+            if self.marg_offset:
+                u = scipy.linalg.cho_solve(cf, np.ones(len(resid)))
+                b = u @ resid
+                S = np.sum(u)
+                self.offset = b / S
+                logLLH += 0.5 * b * self.offset - 0.5 * np.log(S)
+        if not np.isfinite(logLLH):
+            return -np.inf
+        return logLLH
+
+    def fit_minuit_scatter(self, guess, fixpars=None, limits=None, simplex=False):
+        ### Minimizes -2 log L directly (a least-squares cost cannot constrain the scatter)
+        import iminuit
+        def cost(pars):
+            return -2 * self.loglike_scatter(np.asarray(pars))
+        m = iminuit.Minuit(cost, guess, name=self.pnames)
+        m.errordef = iminuit.Minuit.LEAST_SQUARES
+        mylimits = [(None, None)] * (len(guess) - self.nscatter) + [(0, None)] * self.nscatter
+        if limits is not None:
+            for k in range(len(limits)):
+                mylimits[limits[k][0]] = (limits[k][1], limits[k][2])
+        m.limits = mylimits
+        if fixpars is not None:
+            for k in range(len(fixpars)):
+                m.fixed[fixpars[k]] = True
+        if simplex:
+            m.simplex()
+        m.migrad()
+        m.hesse()
+        ch2 = m.fval
+        ndf = len(self.x) - m.nfit - int(self.marg_offset)
+        ### values only: m (and the local model / cost functions it holds) cannot be pickled
+        self.fit = np.array(m.values)
+        return m, ch2, ndf
+
+    def profile_scan(self, guess, scanpars, grids, fixpars=None, limits=None, nproc=1, restart_tol=1.):
+        """
+        Profile likelihood: -2 log L minimized over the free parameters on a grid of the scanned ones.
+
+        Args:
+            guess (array): starting values of all the parameters.
+            scanpars (list): indices of the one or two scanned parameters.
+            grids (list): one 1-D array of values per scanned parameter.
+            fixpars (list): indices of parameters kept at their guess value.
+            limits (list): [index, min, max] triplets as in fit_minuit.
+            nproc (int): number of worker processes (the model must then be picklable).
+            restart_tol (float): a point is also minimized from the global best fit when its warm
+                start is invalid or its -2 log L exceeds the previous point's by more than this.
+
+        Returns:
+            dict: 'chi2' (profile -2 log L, shape of the grid), 'dchi2' (minus the global minimum),
+            'pars' (minimizing parameters at each grid point), 'valid' (migrad validity of the kept
+            minimum at each grid point), 'bestfit' and 'chi2min'.
+        """
+        guess = np.array(guess, dtype=float)
+        shape = [len(g) for g in grids]
+        fixpars = [] if fixpars is None else list(fixpars)
+
+        ### Global minimum, starting point of all the scans
+        m = _profile_minuit(self, guess, fixpars, limits)
+        m.migrad()
+        bestfit = np.array(m.values)
+
+        ### Grid points along a serpentine path so that neighbours follow each other, then
+        ### cut in nproc contiguous segments; each point is warm-started from the previous one,
+        ### and restarted from the global best fit when the warm start fails or drifts
+        idx = np.array(list(np.ndindex(*shape)))
+        if len(shape) == 2:
+            odd = idx[:, 0] % 2 == 1
+            idx[odd, 1] = shape[1] - 1 - idx[odd, 1]
+        points = np.column_stack([np.asarray(grids[k])[idx[:, k]] for k in range(len(shape))])
+        segments = np.array_split(np.arange(len(points)), max(1, min(nproc, len(points))))
+        tasks = [(self, bestfit, list(scanpars), points[seg], fixpars, limits, restart_tol) for seg in segments]
+        if nproc > 1:
+            import multiprocessing
+            with multiprocessing.Pool(nproc) as pool:
+                results = pool.map(_profile_segment, tasks)
+        else:
+            results = [_profile_segment(t) for t in tasks]
+
+        chi2 = np.zeros(shape)
+        pars = np.zeros(shape + [len(guess)])
+        valid = np.zeros(shape, dtype=bool)
+        for seg, (c, p, v) in zip(segments, results):
+            chi2[tuple(idx[seg].T)] = c
+            pars[tuple(idx[seg].T)] = p
+            valid[tuple(idx[seg].T)] = v
+        chi2min = min(m.fval, np.min(chi2))
+        return {'chi2': chi2, 'dchi2': chi2 - chi2min, 'pars': pars, 'valid': valid, 'bestfit': bestfit,
+                'chi2min': chi2min}
+
+    def fit_minuit(self, guess, fixpars = None, limits=None, scan=None, renorm=False, simplex=False, minimizer=None, grad=None):
+        if self.nscatter:
+            return self.fit_minuit_scatter(guess, fixpars=fixpars, limits=limits, simplex=simplex)
+        import iminuit
+        if minimizer is None:
+            from iminuit.cost import LeastSquares
+            minimizer = LeastSquares
         ok = np.isfinite(self.x) & (self.errors != 0)
 
+        ### Analytic gradient of the model w.r.t. the parameters (used by migrad if given)
+        ### grad(x, pars) returns (npars, len(x)); the model is then declared with one
+        ### parameter per entry of guess so that iminuit can match both
+        model = self.model
+        if self.marg_offset:
+            ### Offset profiled analytically (same minimum as the marginalized likelihood)
+            w = 1. / self.errors[ok]**2
+            def model(x, pars):
+                mval = self.model(x, pars)
+                return mval + np.sum(w * (self.y[ok] - mval)) / np.sum(w)
+            if grad is not None:
+                ### gradient of the profiled model: the offset moves with the parameters
+                rawgrad = grad
+                def grad(x, pars):
+                    g = np.asarray(rawgrad(x, pars))
+                    return g - (np.sum(w * g, axis=1) / np.sum(w))[:, None]
+        gradargs = {}
+        if grad is not None:
+            arraymodel = model
+            def model(x, *pars):
+                return arraymodel(x, np.ravel(pars))
+            model._parameters = dict.fromkeys(['x'] + ['x{}'.format(k) for k in range(len(guess))])
+            gradargs = {'grad': lambda x, *pars: grad(x, np.ravel(pars))}
+
         ### Prepare Minimizer
         if self.diag == True:
-            myminimizer = minimizer(self.x[ok], self.y[ok], self.errors[ok], self.model)
+            myminimizer = minimizer(self.x[ok], self.y[ok], self.errors[ok], model, **gradargs)
         else:
             print('Non diagonal covariance not yet implemented: using only diagonal')
-            myminimizer = minimizer(self.x[ok], self.y[ok], self.errors[ok], self.model)
+            myminimizer = minimizer(self.x[ok], self.y[ok], self.errors[ok], model, **gradargs)
 
         ### Instanciate the minuit object
         if simplex == False:
@@ -236,9 +546,9 @@ class Data:
         ### Fixed parameters
         if fixpars is not None:
             for k in range(len(guess)):
-                m.fixed["x{}".format(k)]=False
+                m.fixed[k]=False
             for k in range(len(fixpars)):
-                m.fixed["x{}".format(fixpars[k])]=True
+                m.fixed[fixpars[k]]=True
 
         ### If requested, perform a scan on the parameters
         if scan is not None:
@@ -251,8 +561,9 @@ class Data:
         m.hesse()   
 
         ch2 = m.fval
-        ndf = len(self.x[ok]) - m.nfit
-        self.fit = m.values
+        ndf = len(self.x[ok]) - m.nfit - int(self.marg_offset)
+        ### values only: m (and the local model / cost functions it holds) cannot be pickled
+        self.fit = np.array(m.values)
 
         self.fit_info = [
             f"$\\chi^2$ / $n_\\mathrm{{dof}}$ = {ch2:.1f} / {ndf}",
@@ -268,6 +579,7 @@ class Data:
         return m, ch2, ndf
 
     def run_mcmc(self, p0, allvariables, nbmc=3000, fixpars=None, nwalkers=32, nsigmas=3., fidvalues=None):
+        import emcee
         if fidvalues is not None:
             p0 = fidvalues
         if fixpars is not None:
@@ -293,6 +605,9 @@ class Data:
         pos = np.zeros((nwalkers, ndim))
         for d in range(ndim):
             pos[:, d] = np.random.randn(nwalkers) * np.sqrt(errm[d]) * nsigmas + parm[d]
+        if self.nscatter:
+            ### Walkers start with a positive intrinsic scatter
+            pos[:, ndim-self.nscatter:] = np.abs(pos[:, ndim-self.nscatter:])
         print('Ndim init:', ndim)
         if fixpars is not None:
             ndim = len(allvariables) - len(self.fixedpars)
@@ -305,11 +620,11 @@ class Data:
             print('New len(pos):', np.shape(pos))
         ## Burn
         print('Burning')
-        state = sampler.run_mcmc(pos, nbmc//3, progress=True)
+        state = self.sample(sampler, pos, nbmc//3)
         sampler.reset()
         ## sample
         print('Sampling')
-        sampler.run_mcmc(state, nbmc, progress=True)
+        self.sample(sampler, state, nbmc)
 
         allchains = sampler.get_chain(flat=True)
         chains = {}
@@ -333,6 +648,30 @@ class Datas(Data):
             self.datas.append(datalist[i])
         self.pnames = pnames
         self.fixedpars = None
+        self.nscatter = 0
+        self.telemetry = None
+
+    def enable_telemetry(self, telemetry=None, names=None, **kwargs):
+        ### One shared Telemetry, with per dataset statistics
+        if telemetry is None:
+            telemetry = Telemetry(**kwargs)
+        if names is None:
+            names = ['data{}'.format(i) for i in range(self.ndatas)]
+        for i in range(self.ndatas):
+            self.datas[i].enable_telemetry(telemetry, name=names[i])
+        self.telemetry = telemetry
+        return telemetry
+
+    def disable_telemetry(self):
+        for i in range(self.ndatas):
+            self.datas[i].disable_telemetry()
+        self.telemetry = None
+
+    def telemetry_models(self):
+        models = {}
+        for i in range(self.ndatas):
+            models.update(self.datas[i].telemetry_models())
+        return models
 
     def __call__(self, mytheta, extra_args=None, verbose=False):
         logLLH = 0.
@@ -340,22 +679,79 @@ class Datas(Data):
             logLLH += self.datas[i](mytheta, extra_args=extra_args, verbose=verbose)
         return logLLH
 
-    def fit_minuit(self, guess, fixpars = None, limits=None, scan=None, renorm=False, simplex=False, minimizer=LeastSquares):
+    def loglike(self, theta, verbose=False):
+        logLLH = 0.
+        for i in range(self.ndatas):
+            logLLH += self.datas[i].loglike(theta, verbose=verbose)
+        return logLLH
+
+    def fit_minuit(self, guess, fixpars = None, limits=None, scan=None, renorm=False, simplex=False, minimizer=None, grad=None):
         for i in range(self.ndatas):
-            m, ch2, ndf = self.datas[i].fit_minuit(guess, fixpars=fixpars, limits=limits, scan=scan, renorm=renorm, simplex=simplex, minimizer=minimizer)
+            m, ch2, ndf = self.datas[i].fit_minuit(guess, fixpars=fixpars, limits=limits, scan=scan, renorm=renorm, simplex=simplex, minimizer=minimizer, grad=grad)
         return m, ch2, ndf
 
 
 
+### Profile likelihood helpers (module level so that they can be sent to worker processes)
+def _profile_minuit(data, guess, fixpars, limits):
+    import iminuit
+    def cost(pars):
+        logLLH = data.loglike(np.asarray(pars))
+        return -2 * logLLH if np.isfinite(logLLH) else 1e30
+    m = iminuit.Minuit(cost, guess, name=data.pnames)
+    m.errordef = iminuit.Minuit.LEAST_SQUARES
+    mylimits = [(None, None)] * (len(guess) - data.nscatter) + [(0, None)] * data.nscatter
+    if limits is not None:
+        for k in range(len(limits)):
+            mylimits[limits[k][0]] = (limits[k][1], limits[k][2])
+    m.limits = mylimits
+    for k in fixpars:
+        m.fixed[k] = True
+    return m
+
+def _profile_segment(args):
+    data, start, scanpars, points, fixpars, limits, restart_tol = args
+    m = _profile_minuit(data, start, fixpars + scanpars, limits)
+    chi2 = np.zeros(len(points))
+    pars = np.zeros((len(points), len(start)))
+    valid = np.zeros(len(points), dtype=bool)
+    for i in range(len(points)):
+        for k in range(len(scanpars)):
+            m.values[scanpars[k]] = points[i, k]
+        m.migrad()
+        chi2[i], pars[i], valid[i] = m.fval, np.array(m.values), m.valid
+        if not m.valid or (i > 0 and m.fval > chi2[i-1] + restart_tol):
+            ### Warm start failed or drifted: minimize again from the global best fit, keep the lower
+            ### minimum (and continue the path from it)
+            fresh = _profile_minuit(data, start, fixpars + scanpars, limits)
+            for k in range(len(scanpars)):
+                fresh.values[scanpars[k]] = points[i, k]
+            fresh.migrad()
+            if fresh.fval < chi2[i]:
+                chi2[i], pars[i], valid[i] = fresh.fval, np.array(fresh.values), fresh.valid
+                m.values = fresh.values
+    return chi2, pars, valid
+
+def profile_interval(grid, dchi2, level=1.):
+    ### Interval where the 1-D profile dchi2 is below level (1 -> 68%, 4 -> 95% for one parameter),
+    ### crossings linearly interpolated between grid points
+    inside = np.where(dchi2 <= level)[0]
+    if len(inside) == 0:
+        return [np.nan, np.nan]
+    i0, i1 = inside[0], inside[-1]
+    lo = grid[i0] if i0 == 0 else np.interp(level, [dchi2[i0], dchi2[i0-1]], [grid[i0], grid[i0-1]])
+    hi = grid[i1] if i1 == len(grid)-1 else np.interp(level, [dchi2[i1], dchi2[i1+1]], [grid[i1], grid[i1+1]])
+    return [lo, hi]
+
 def thepolynomial(x,pars):
     f=np.poly1d(pars)
     return(f(x))
 
-def do_minuit(x,y,covarin,guess,functname=thepolynomial, verbose=True, fixpars=None):
+def do_minuit(x,y,covarin,guess,functname=thepolynomial, verbose=True, fixpars=None, grad=None):
     data = Data(x,y,covarin, functname)
     if verbose:
         print('Fitting with Minuit')
-    fitm, ch2, ndf = data.fit_minuit(guess, fixpars=fixpars)
+    fitm, ch2, ndf = data.fit_minuit(guess, fixpars=fixpars, grad=grad)
     if verbose:
         print('Chi2 = {}'.format(ch2))
         print('ndf = {}'.format(ndf))
@@ -367,106 +763,136 @@ def do_minuit(x,y,covarin,guess,functname=thepolynomial, verbose=True, fixpars=N
         print(np.array(fitm.covariance))
     return fitm, np.array(fitm.values), np.array(fitm.errors), np.array(fitm.covariance), ch2, ndf
 
-def matrixplot(chain,vars,col,sm,limits=None,nbins=None,doit=None,alpha=0.7,labels=None):
-    nplots=len(vars)
-    if labels is None: labels = vars
-    if doit is None: doit=np.repeat([True],nplots)
-    mm=np.zeros(nplots)
-    ss=np.zeros(nplots)
-    for i in range(nplots):
-        if vars[i] in chain.keys():
-            mm[i]=np.mean(chain[vars[i]])
-            ss[i]=np.std(chain[vars[i]])
-    if limits is None:
-        limits=[]
-        for i in range(nplots):
-            limits.append([mm[i]-3*ss[i],mm[i]+3*ss[i]])
-    num=0
-    for i in range(nplots):
-         for j in range(nplots):
-            num+=1
-            if (i == j):
-                a=subplot(nplots,nplots,num)
-                a.tick_params(labelsize=8)
-                if i == nplots-1: xlabel(labels[j])
-                var=vars[j]
-                xlim(limits[i])
-                ylim(0,1.2)
-                if (var in chain.keys()) and (doit[j]==True):
-                    if nbins is None: nbins=100
-                    bla=np.histogram(chain[var],bins=nbins,density=True)
-                    xhist=(bla[1][0:nbins]+bla[1][1:nbins+1])/2
-                    yhist=gaussian_filter1d(bla[0],ss[i]/5/(xhist[1]-xhist[0]))
-                    plot(xhist,yhist/max(yhist),color=col, label = '{0:.2g} +/- {1:.2g}'.format(np.mean(chain[var]), np.std(chain[var])))
-                    legend(loc='upper left',frameon=False,fontsize=8)
-            if (i>j):
-                a=subplot(nplots,nplots,num)
-                a.tick_params(labelsize=8)
-                var0=labels[j]
-                var1=labels[i]
-                xlim(limits[j])
-                ylim(limits[i])
-                if i == nplots-1: xlabel(var0)
-                if j == 0: ylabel(var1)
-                if (vars[i] in chain.keys()) and (vars[j] in chain.keys()) and (doit[j]==True) and (doit[i]==True):
-                    a0=cont(chain[vars[j]],chain[vars[i]],color=col,nsmooth=sm,alpha=alpha)
-    return(a0)
-    
-def getcols(color):
-    if color == 'blue':
-        cols=['SkyBlue','MediumBlue']
-    elif color == 'red':
-        cols=['LightCoral','Red']
-    elif color == 'green':
-        cols=['LightGreen','Green']
-    elif color == 'pink':
-        cols=['LightPink','HotPink']
-    elif color == 'orange':
-        cols=['Coral','OrangeRed']
-    elif color == 'yellow':
-        cols=['Yellow','Gold']
-    elif color == 'purple':
-        cols=['Violet','DarkViolet']
-    elif color == 'brown':
-        cols=['BurlyWood','SaddleBrown']
-    return(cols)
-
-
-def cont(x,y,xlim=None,ylim=None,levels=[0.9545,0.6827],alpha=0.7,color='blue',nbins=256,nsmooth=4,Fill=True,**kwargs):
-    levels.sort()
-    levels.reverse()
-    cols=getcols(color)
-    dx=np.max(x)-np.min(x)
-    dy=np.max(y)-np.min(y)
-    if xlim is None: xlim=[np.min(x)-dx/3,np.max(x)+dx/3]
-    if ylim is None: ylim=[np.min(y)-dy/3,np.max(y)+dy/3]
-    range=[xlim,ylim]
-    a,xmap,ymap=np.histogram2d(x,y,bins=256,range=range)
-    a=np.transpose(a)
-    xmap=xmap[:-1]
-    ymap=ymap[:-1]
-    dx=xmap[1]-xmap[0]
-    dy=ymap[1]-ymap[0]
-    z=scipy.ndimage.filters.gaussian_filter(a,nsmooth)
-    z=z/np.sum(z)/dx/dy
-    sz=np.sort(z.flatten())[::-1]
-    cumsz=integrate.cumulative_trapezoid(sz)
-    cumsz=cumsz/max(cumsz)
-    f=interpolate.interp1d(cumsz,np.arange(np.size(cumsz)))
-    indices=f(levels).astype('int')
-    vals=sz[indices].tolist()
-    vals.append(np.max(sz))
-    vals.sort()
-    if Fill:
-        for i in np.arange(np.size(levels)):
-            contourf(xmap, ymap, z, vals[i:i+2],colors=cols[i],alpha=alpha,**kwargs)
-    else:
-        contour(xmap, ymap, z, vals[0:1],colors=cols[1],**kwargs)
-        contour(xmap, ymap, z, vals[1:2],colors=cols[1],**kwargs)
-    a=Rectangle((np.max(xmap),np.max(ymap)),0.1,0.1,fc=cols[1])
-    return(a)
-
-   
 ###############################################################################
 ###############################################################################
             
+
+
+###############################################################################
+########################## Grid Posterior Evaluation ##########################
+###############################################################################
+### For 2-3 free parameters a dense grid is faster and more accurate than MCMC.
+### The chi2 is evaluated on the mesh in chunks of points (bounded memory), each chunk
+### being one vectorized call of a batch model model(x, pars) with pars of shape (npts, npars)
+### returning (npts, len(x)). Chunks can be spread over processes.
+
+### SNIa distance modulus for a batch of cosmologies, pars[:, :] = [omega_M_0, omega_lambda_0, w0, h]
+### (same integration scheme as propdist, run simultaneously for all rows of pars)
+def musn1a_batch(z, pars, zres=0.001):
+    pars = np.atleast_2d(pars)
+    om, ol, w0, h = [pars[:, k:k+1] for k in range(4)]
+    zmax = np.max(z)
+    nb = 101 if zmax < zres else int(zmax/zres+1)
+    zvals = np.linspace(0., zmax, nb)
+    ok = 1. - om - ol
+    ### powers of (1+z) shared by all rows (the dark energy one too when w0 is the same everywhere)
+    if np.all(w0 == w0[0]):
+        dez = (1+zvals)**(3+3*w0[0])
+    else:
+        dez = (1+zvals)**(3+3*w0)
+    with np.errstate(invalid='ignore'):
+        inv_ez = 1./np.sqrt(ok*(1+zvals)**2 + ol*dez + om*(1+zvals)**3)
+    ### cumulative trapezoid on the uniform zvals
+    cumulative = np.zeros((len(pars), nb))
+    np.cumsum((inv_ez[:, 1:]+inv_ez[:, :-1])*(0.5*(zvals[1]-zvals[0])), axis=1, out=cumulative[:, 1:])
+    ### linear interpolation at z (uniform zvals)
+    pos = np.clip(np.asarray(z)/zvals[-1]*(nb-1), 0, nb-1)
+    i0 = np.minimum(pos.astype(int), nb-2)
+    f = pos - i0
+    dist = cumulative[:, i0]*(1-f) + cumulative[:, i0+1]*f
+    ### curvature
+    k = np.abs(ok)
+    sk = np.sqrt(np.where(k > 0, k, 1.))
+    dist = np.where(ok > 0, np.sinh(sk*dist)/sk, np.where(ok < 0, np.sin(sk*dist)/sk, dist))
+    dlum = dist*2.99792458e5/100/h*(1+z)*1e6
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 5*np.log10(dlum)-5+5*np.log10(h/0.7)
+
+def _grid_chunk(args):
+    ### chi2 of the grid points [start, stop) (module level so that it can be sent to workers)
+    start, stop, axes, x, y, invcov, diag, model, marg_offset = args
+    idx = np.unravel_index(np.arange(start, stop), [len(a) for a in axes])
+    pars = np.column_stack([axes[k][idx[k]] for k in range(len(axes))])
+    resid = y - model(x, pars)
+    if diag:
+        wr = resid*invcov
+    else:
+        wr = resid @ invcov
+    chi2 = np.sum(wr*resid, axis=1)
+    if marg_offset:
+        ### analytic marginalization of an additive offset (see Data)
+        invcov_one = invcov if diag else invcov @ np.ones(len(y))
+        chi2 -= np.sum(wr, axis=1)**2/np.sum(invcov_one)
+    return np.where(np.isfinite(chi2), chi2, np.inf)
+
+def grid_chi2(x, y, cov, axes, model=musn1a_batch, marg_offset=False, chunk=2048, nproc=1):
+    """
+    Chi2 of data (x, y, cov) on the mesh spanned by axes.
+
+    Args:
+        x, y (array): data.
+        cov (array): errors (same size as y) or covariance matrix.
+        axes (list): one 1-D array per model parameter (single value for fixed ones).
+        model (function): batch model model(x, pars), pars of shape (npts, npars).
+        marg_offset (bool): marginalize an additive offset of the model analytically.
+        chunk (int): number of grid points evaluated at once.
+        nproc (int): number of worker processes.
+
+    Returns:
+        array: chi2 with shape (len(axes[0]), len(axes[1]), ...).
+    """
+    axes = [np.atleast_1d(np.asarray(a, dtype=float)) for a in axes]
+    shape = [len(a) for a in axes]
+    if np.prod(np.shape(x)) == np.prod(np.shape(cov)):
+        diag = True
+        invcov = 1./np.asarray(cov)**2
+    else:
+        diag = False
+        invcov = np.linalg.inv(cov)
+    npts = int(np.prod(shape))
+    tasks = [(start, min(start+chunk, npts), axes, x, y, invcov, diag, model, marg_offset)
+             for start in range(0, npts, chunk)]
+    if nproc > 1:
+        import multiprocessing
+        with multiprocessing.Pool(nproc) as pool:
+            chi2 = pool.map(_grid_chunk, tasks)
+    else:
+        chi2 = [_grid_chunk(t) for t in tasks]
+    return np.concatenate(chi2).reshape(shape)
+
+def grid_posterior(chi2, axes, keep=(0, 1)):
+    """
+    Normalized posterior (flat priors) marginalized over all axes but keep.
+
+    Returns:
+        array: posterior density on the kept axes, in the order of keep (integrates to 1
+        with trapezoid weights).
+    """
+    from scipy.integrate import trapezoid
+    for k, a in enumerate(axes):
+        if np.any(np.diff(np.atleast_1d(a)) <= 0):
+            raise ValueError("grid axis {} is not strictly increasing".format(k))
+    ### marginalized axes are integrated out in grid order, the kept ones remain in grid order
+    kept = sorted(keep)
+    post = np.exp(-0.5*(chi2 - np.min(chi2)))
+    for k in reversed(range(len(axes))):
+        if k not in kept:
+            post = trapezoid(post, axes[k], axis=k) if len(axes[k]) > 1 else post.take(0, axis=k)
+    norm = post
+    for k in reversed(range(post.ndim)):
+        norm = trapezoid(norm, axes[kept[k]], axis=k)
+    return np.transpose(post/norm, [kept.index(k) for k in keep])
+
+def grid_levels(post, levels=[0.9545, 0.6827]):
+    ### Density thresholds enclosing the credible levels (highest posterior density regions)
+    p = np.sort(post.ravel())[::-1]
+    cum = np.cumsum(p)/np.sum(p)
+    return [p[min(np.searchsorted(cum, l), len(p)-1)] for l in levels]
+
+def grid_interval(post1d, xvals, level=0.6827):
+    ### Mean, std and highest-density interval of a 1-D marginal
+    w = post1d/np.sum(post1d)
+    mean = np.sum(w*xvals)
+    std = np.sqrt(np.sum(w*(xvals-mean)**2))
+    inside = xvals[post1d >= grid_levels(post1d, [level])[0]]
+    return mean, std, [np.min(inside), np.max(inside)]
@@ -0,0 +1,234 @@
+from pylab import *
+import numpy as np
+from matplotlib import *
+from matplotlib.pyplot import *
+
+from cosmolib import grid_levels
+
+### Plotting layer of cosmolib (imported on first use of cs.matrixplot, cs.cont, ...)
+
+
+###############################################################################
+############################ Binned Chain Densities ###########################
+###############################################################################
+### All the 1-D and 2-D histograms of a chain are filled in one pass over each chunk of samples
+### (bin indices computed once per parameter, one bincount per pair), smoothed by FFT
+### convolution with a Gaussian, and the credible levels come from a cumulative histogram of
+### the density values instead of a sort of all of them. Chunks can be added while sampling.
+
+def fft_smooth(a, sigma):
+    ### Gaussian smoothing (sigma in bins, per axis) by FFT, zero padded so that nothing wraps around
+    sigma = np.broadcast_to(sigma, (a.ndim,))
+    pad = [int(np.ceil(4*s)) for s in sigma]
+    shape = [n + 2*p for n, p in zip(a.shape, pad)]
+    fa = np.fft.rfftn(a, s=shape)
+    kernel = 1.
+    for k in range(a.ndim):
+        f = np.fft.rfftfreq(shape[k]) if k == a.ndim-1 else np.fft.fftfreq(shape[k])
+        g = np.exp(-2*(np.pi*sigma[k]*f)**2)
+        kernel = kernel*g.reshape([-1 if i == k else 1 for i in range(a.ndim)])
+    out = np.fft.irfftn(fa*kernel, s=shape)
+    ### the padding of the end wraps to the start: drop both
+    return out[tuple(slice(0, n) for n in a.shape)]
+
+def density_levels(z, levels=[0.9545, 0.6827], nbins=4096):
+    ### Density thresholds enclosing the fractions levels of the total mass, from a cumulative
+    ### histogram of the density values (weighted by themselves)
+    z = np.ravel(z)
+    h, edges = np.histogram(z, bins=nbins, range=(0, np.max(z)), weights=z)
+    above = np.cumsum(h[::-1])[::-1]/np.sum(h)
+    return [edges[max(np.searchsorted(-above, -l, side='right')-1, 0)] for l in levels]
+
+class ChainDensity:
+    """
+    Streaming binned densities of chain parameters.
+
+    Args:
+        vars (list): parameter names (keys of the chain dicts given to update).
+        ranges (list): [min, max] per parameter of the 2-D histograms; if None, taken from the
+            first chunk as [min - d/3, max + d/3] as cont does (later samples outside are not binned).
+        nbins (int): bins per axis of the 2-D histograms.
+        nbins1d (int): bins of the 1-D histograms.
+        ranges1d (list): [min, max] per parameter of the 1-D histograms; if None, ranges when
+            given, else [min, max] of the first chunk as np.histogram does.
+    """
+    def __init__(self, vars, ranges=None, nbins=256, nbins1d=100, ranges1d=None):
+        self.vars = list(vars)
+        self.ranges = None if ranges is None else np.array(ranges, dtype=float)
+        if ranges1d is None and ranges is not None:
+            ranges1d = ranges
+        self.ranges1d = None if ranges1d is None else np.array(ranges1d, dtype=float)
+        self.nbins = nbins
+        self.nbins1d = nbins1d
+        nv = len(self.vars)
+        self.hist1d = np.zeros((nv, nbins1d))
+        self.hist2d = {}
+        self.n = 0
+        self.sum = np.zeros(nv)
+        self.sum2 = np.zeros(nv)
+
+    def update(self, chain):
+        """Adds samples: dict of arrays (one per parameter) or array of shape (nsamples, nvars)."""
+        if isinstance(chain, dict):
+            samples = np.column_stack([np.ravel(chain[v]) for v in self.vars])
+        else:
+            samples = np.reshape(chain, (-1, len(self.vars)))
+        if self.ranges is None or self.ranges1d is None:
+            lo, hi = np.min(samples, axis=0), np.max(samples, axis=0)
+            if self.ranges is None:
+                self.ranges = np.column_stack([lo-(hi-lo)/3, hi+(hi-lo)/3])
+            if self.ranges1d is None:
+                self.ranges1d = np.column_stack([lo, hi])
+        self.n += len(samples)
+        self.sum += np.sum(samples, axis=0)
+        self.sum2 += np.sum(samples**2, axis=0)
+        ### bin indices of every parameter, computed once (samples outside go to an overflow bin)
+        u = (samples - self.ranges[:, 0])/(self.ranges[:, 1] - self.ranges[:, 0])
+        outside = (u < 0) | (u >= 1)
+        nb = self.nbins + 1
+        ix = np.where(outside, self.nbins, u*self.nbins).astype(np.intp)
+        ### 1-D bins over their own range, the upper edge included in the last bin as in np.histogram
+        u1 = (samples - self.ranges1d[:, 0])/(self.ranges1d[:, 1] - self.ranges1d[:, 0])
+        ix1 = np.where((u1 < 0) | (u1 > 1), self.nbins1d, np.minimum(u1*self.nbins1d, self.nbins1d-1)).astype(np.intp)
+        for i in range(len(self.vars)):
+            self.hist1d[i] += np.bincount(ix1[:, i], minlength=self.nbins1d+1)[:-1]
+            row = ix[:, i]*nb
+            for j in range(i):
+                h = np.bincount(row + ix[:, j], minlength=nb**2).reshape(nb, nb)[:-1, :-1]
+                self.hist2d[(j, i)] = self.hist2d.get((j, i), 0) + h.T
+        return self
+
+    def mean(self):
+        return self.sum/self.n
+
+    def std(self):
+        return np.sqrt(np.maximum(self.sum2/self.n - self.mean()**2, 0))
+
+    def centers(self, i, nbins, ranges=None):
+        ranges = self.ranges if ranges is None else ranges
+        edges = np.linspace(ranges[i][0], ranges[i][1], nbins+1)
+        return 0.5*(edges[1:]+edges[:-1])
+
+    def density1d(self, i, sigma):
+        ### Smoothed 1-D density (sigma in units of the parameter), normalized to a maximum of 1
+        x = self.centers(i, self.nbins1d, self.ranges1d)
+        y = fft_smooth(self.hist1d[i], sigma/(x[1]-x[0]))
+        return x, y/np.max(y)
+
+    def density2d(self, i, j, nsmooth=4):
+        ### Smoothed 2-D density of (vars[i], vars[j]) as z[iy, ix], normalized to unit integral
+        x = self.centers(i, self.nbins)
+        y = self.centers(j, self.nbins)
+        h = self.hist2d[(i, j)] if (i, j) in self.hist2d else self.hist2d[(j, i)].T
+        z = fft_smooth(h.T, nsmooth)
+        z = np.maximum(z, 0)
+        return x, y, z/np.sum(z)/(x[1]-x[0])/(y[1]-y[0])
+
+    def cont(self, i, j, levels=[0.9545, 0.6827], alpha=0.7, color='blue', nsmooth=4, Fill=True, **kwargs):
+        ### Credible contours of (vars[i], vars[j]), drawn as in cont
+        levels = sorted(levels, reverse=True)
+        cols = getcols(color)
+        xmap, ymap, z = self.density2d(i, j, nsmooth)
+        vals = density_levels(z, levels)
+        vals.append(np.max(z))
+        vals.sort()
+        if Fill:
+            for k in np.arange(np.size(levels)):
+                contourf(xmap, ymap, z, vals[k:k+2], colors=cols[k], alpha=alpha, **kwargs)
+        else:
+            contour(xmap, ymap, z, vals[0:1], colors=cols[1], **kwargs)
+            contour(xmap, ymap, z, vals[1:2], colors=cols[1], **kwargs)
+        a = Rectangle((np.max(xmap), np.max(ymap)), 0.1, 0.1, fc=cols[1])
+        return(a)
+
+
+def matrixplot(chain,vars,col,sm,limits=None,nbins=None,doit=None,alpha=0.7,labels=None,density=None):
+    ### chain: dict of samples, or None if density (a ChainDensity over vars, e.g. filled while sampling) is given
+    nplots=len(vars)
+    if labels is None: labels = vars
+    if doit is None: doit=np.repeat([True],nplots)
+    if density is None:
+        present=[v for v in vars if v in chain.keys()]
+        density=ChainDensity(present, nbins1d=100 if nbins is None else nbins).update(chain)
+    mm=np.zeros(nplots)
+    ss=np.zeros(nplots)
+    for i in range(nplots):
+        if vars[i] in density.vars:
+            mm[i]=density.mean()[density.vars.index(vars[i])]
+            ss[i]=density.std()[density.vars.index(vars[i])]
+    if limits is None:
+        limits=[]
+        for i in range(nplots):
+            limits.append([mm[i]-3*ss[i],mm[i]+3*ss[i]])
+    a0=None
+    num=0
+    for i in range(nplots):
+         for j in range(nplots):
+            num+=1
+            if (i == j):
+                a=subplot(nplots,nplots,num)
+                a.tick_params(labelsize=8)
+                if i == nplots-1: xlabel(labels[j])
+                var=vars[j]
+                xlim(limits[i])
+                ylim(0,1.2)
+                if (var in density.vars) and (doit[j]==True):
+                    xhist,yhist=density.density1d(density.vars.index(var),ss[i]/5)
+                    plot(xhist,yhist,color=col, label = '{0:.2g} +/- {1:.2g}'.format(mm[i], ss[i]))
+                    legend(loc='upper left',frameon=False,fontsize=8)
+            if (i>j):
+                a=subplot(nplots,nplots,num)
+                a.tick_params(labelsize=8)
+                var0=labels[j]
+                var1=labels[i]
+                xlim(limits[j])
+                ylim(limits[i])
+                if i == nplots-1: xlabel(var0)
+                if j == 0: ylabel(var1)
+                if (vars[i] in density.vars) and (vars[j] in density.vars) and (doit[j]==True) and (doit[i]==True):
+                    a0=density.cont(density.vars.index(vars[j]),density.vars.index(vars[i]),color=col,nsmooth=sm,alpha=alpha)
+    return(a0)
+    
+def getcols(color):
+    if color == 'blue':
+        cols=['SkyBlue','MediumBlue']
+    elif color == 'red':
+        cols=['LightCoral','Red']
+    elif color == 'green':
+        cols=['LightGreen','Green']
+    elif color == 'pink':
+        cols=['LightPink','HotPink']
+    elif color == 'orange':
+        cols=['Coral','OrangeRed']
+    elif color == 'yellow':
+        cols=['Yellow','Gold']
+    elif color == 'purple':
+        cols=['Violet','DarkViolet']
+    elif color == 'brown':
+        cols=['BurlyWood','SaddleBrown']
+    return(cols)
+
+
+
+def cont(x,y,xlim=None,ylim=None,levels=[0.9545,0.6827],alpha=0.7,color='blue',nbins=256,nsmooth=4,Fill=True,**kwargs):
+    dx=np.max(x)-np.min(x)
+    dy=np.max(y)-np.min(y)
+    if xlim is None: xlim=[np.min(x)-dx/3,np.max(x)+dx/3]
+    if ylim is None: ylim=[np.min(y)-dy/3,np.max(y)+dy/3]
+    density=ChainDensity(['x','y'],ranges=[xlim,ylim],nbins=nbins).update(np.column_stack([x,y]))
+    return density.cont(0,1,levels=levels,alpha=alpha,color=color,nsmooth=nsmooth,Fill=Fill,**kwargs)
+
+def grid_cont(xvals, yvals, post2d, levels=[0.9545, 0.6827], alpha=0.7, color='blue', Fill=True, **kwargs):
+    ### Same as cont but with exact credible contours of a gridded posterior post2d[ix, iy]
+    cols = getcols(color)
+    vals = grid_levels(post2d, levels)
+    vals.append(np.max(post2d))
+    vals.sort()
+    z = np.transpose(post2d)
+    if Fill:
+        for i in np.arange(np.size(levels)):
+            contourf(xvals, yvals, z, vals[i:i+2], colors=cols[i], alpha=alpha, **kwargs)
+    else:
+        contour(xvals, yvals, z, vals[0:2], colors=cols[1], **kwargs)
+    a = Rectangle((np.max(xvals), np.max(yvals)), 0.1, 0.1, fc=cols[1])
+    return(a)
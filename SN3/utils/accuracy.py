@@ -0,0 +1,137 @@
+# Accuracy / speed of the cosmolib distance functions against a quad reference
+import os
+import sys
+import json
+import time
+import numpy as np
+from scipy.integrate import quad
+import cosmolib as cs
+
+C_OVER_H100 = 2.99792458e5 / 100
+# Same unit conversion as cosmolib.lookback (Gyr)
+GYR = (3.26 * 1e6 * 365 * 24 * 3600 * 3e5) / (365 * 24 * 3600) / 1e9
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'accuracy_baseline.json')
+
+ZRES = [0.01, 0.003, 0.001, 0.0003]
+
+# Flat, open and closed cosmologies, with and without w0 = -1
+COSMO_GRID = [{'omega_M_0': om, 'omega_lambda_0': ol, 'w0': w0, 'h': 0.7, 'omega_b_0': 0.048, 'omega_n_0': 0.}
+              for om in [0.1, 0.3, 0.5] for ol in [0.5, 0.7, 0.9] for w0 in [-1.2, -1., -0.8]]
+
+# Not aligned with the zres grids, so that the interpolation error is included
+Z_SN = np.geomspace(0.01, 1.5, 150)
+ZSTAR = 1090.49
+
+
+# -------------------- Quadrature references --------------------
+def curvature(dist, cosmo):
+    ### Same convention as cosmolib.propdist
+    omega = cosmo['omega_M_0'] + cosmo['omega_lambda_0']
+    k = np.abs(1 - omega)
+    if omega == 1:
+        return dist
+    elif omega < 1:
+        return np.sinh(np.sqrt(k) * dist) / np.sqrt(k)
+    return np.sin(np.sqrt(k) * dist) / np.sqrt(k)
+
+def ref_propdist(z, cosmo):
+    z = np.atleast_1d(z)
+    ### integrate between consecutive redshifts and accumulate
+    edges = np.concatenate([[0.], np.sort(z)])
+    steps = [quad(cs.inv_e_z, a, b, args=(cosmo,), epsabs=0, epsrel=1e-12, limit=200)[0] for a, b in zip(edges[:-1], edges[1:])]
+    dist = np.empty(len(z))
+    dist[np.argsort(z)] = np.cumsum(steps)
+    return curvature(dist, cosmo) * C_OVER_H100 / cosmo['h']
+
+def ref_angdist(z, cosmo):
+    return ref_propdist(z, cosmo) / (1 + np.atleast_1d(z))
+
+def ref_lookback(z, cosmo):
+    z = np.atleast_1d(z)
+    f = lambda x: cs.inv_e_z(x, cosmo) / (1 + x)
+    return np.array([quad(f, 0, zi, epsabs=0, epsrel=1e-12, limit=200)[0] for zi in z]) / 100 / cosmo['h'] * GYR
+
+def ref_thetastar(cosmo, zstar=ZSTAR):
+    return cs.rs(cosmo, zd=zstar) / (1 + zstar) / ref_angdist(zstar, cosmo)[0]
+
+
+# -------------------- Fast paths --------------------
+# name: (fast function(cosmo, zres), reference function(cosmo))
+def paths():
+    return {
+        'propdist': (lambda c, zres: cs.propdist(Z_SN, c, zres=zres), lambda c: ref_propdist(Z_SN, c)),
+        'angdist': (lambda c, zres: cs.angdist(Z_SN, c, zres=zres), lambda c: ref_angdist(Z_SN, c)),
+        'lookback': (lambda c, zres: cs.lookback(Z_SN, c, zres=zres), lambda c: ref_lookback(Z_SN, c)),
+        'angdist_zstar': (lambda c, zres: cs.angdist(ZSTAR, c, zres=zres), lambda c: ref_angdist(ZSTAR, c)),
+        'thetastar': (lambda c, zres: cs.thetastar(c, zstar=ZSTAR, zres=zres), ref_thetastar),
+    }
+
+
+def timeit(func, repeat=20):
+    func()
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - t0) / repeat
+
+
+def run(zres_list=ZRES, cosmo_grid=COSMO_GRID, repeat=20, verbose=True):
+    """
+    Max relative error over cosmo_grid and time per call of every fast path and zres.
+
+    Returns:
+        dict: results[name][str(zres)] = {'max_rel_err': ..., 'time': ...}
+    """
+    results = {}
+    for name, (fast, ref) in paths().items():
+        refs = [ref(c) for c in cosmo_grid]
+        results[name] = {}
+        for zres in zres_list:
+            err = max(np.max(np.abs(fast(c, zres) / r - 1)) for c, r in zip(cosmo_grid, refs))
+            dt = timeit(lambda: fast(cosmo_grid[0], zres), repeat=repeat)
+            results[name][str(zres)] = {'max_rel_err': float(err), 'time': dt}
+            if verbose:
+                print(f"{name:14s} zres={zres:<7g} max rel. error = {err:.2e}   {dt*1e3:8.3f} ms/call")
+    return results
+
+
+def check(results, baseline_file=BASELINE_FILE, slack=0.1, verbose=True):
+    """
+    Flags fast paths whose error grew by more than slack (relative) w.r.t. the baseline
+    (timings are only reported as ratios, they depend on the machine).
+
+    Returns:
+        list: (name, zres, baseline error, new error) of the regressions.
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, byres in results.items():
+        for zres, r in byres.items():
+            if name not in baseline or zres not in baseline[name]:
+                continue
+            b = baseline[name][zres]
+            if r['max_rel_err'] > b['max_rel_err'] * (1 + slack) + 1e-14:
+                regressions.append((name, zres, b['max_rel_err'], r['max_rel_err']))
+            if verbose:
+                print(f"{name:14s} zres={zres:<7s} error x{r['max_rel_err']/max(b['max_rel_err'], 1e-300):.2f}   time x{r['time']/b['time']:.2f}")
+    for reg in regressions:
+        print('REGRESSION {} zres={}: {:.2e} -> {:.2e}'.format(*reg))
+    return regressions
+
+
+def save_baseline(results, baseline_file=BASELINE_FILE):
+    with open(baseline_file, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    # python accuracy.py            -> compare to the baseline (exit code 1 on regression)
+    # python accuracy.py --baseline -> record a new baseline
+    results = run()
+    if '--baseline' in sys.argv or not os.path.exists(BASELINE_FILE):
+        save_baseline(results)
+        print(f"Baseline written to {BASELINE_FILE}")
+    else:
+        sys.exit(1 if check(results) else 0)
@@ -1,24 +1,31 @@
 # MCMC
+import os
+import sys
 import numpy as np
+import pandas as pd
+
+# The fit catalog and its reader (fitcache.py) belong to the joint analysis directory SN3+CMB3,
+# where final.ipynb writes the catalog: both are located from this file, not from the cwd
+SN_CMB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'SN3+CMB3')
+sys.path.insert(0, SN_CMB_DIR)
 import cosmolib as cs
+from fitcache import FitCatalog, CATALOG_FILE
 from matplotlib.pyplot import rc, errorbar, xlim, xlabel, ylabel, legend, show, plot
 from mpl_toolkits.mplot3d import Axes3D
-import pandas as pd
-import glob
-import os
-
-# Find the latest CSV file automatically
-csv_pattern = 'supernova_fitting_results_*.csv'
-csv_files = glob.glob(csv_pattern)
-
-if not csv_files:
-    raise FileNotFoundError(f"No CSV files found matching pattern: {csv_pattern}")
 
-# Sort files by modification time (most recent first)
-latest_csv = max(csv_files, key=os.path.getmtime)
-print(f"Using latest CSV file: {latest_csv}")
+# Fit results queried by configuration: a configuration hash given on the command line,
+# or the one with sigma_int = 0.12
+catalog_file = os.path.join(SN_CMB_DIR, CATALOG_FILE)
+catalog = FitCatalog(catalog_file)
+if len(sys.argv) > 1:
+    results = catalog.query(sys.argv[1])
+else:
+    results = catalog.query(sigma_int=0.12)
+if len(results) == 0:
+    raise ValueError(f"No fit results for this configuration in {catalog_file}")
+print(f"Using {len(results)} fit results from {catalog_file}")
 
-df = pd.read_csv(latest_csv)
+df = pd.DataFrame(results)
 
 z = df['redshift'].values
 mu_exp = df['mu'].values
@@ -0,0 +1,164 @@
+# Mock SN catalogs and bias / coverage validation of the cosmology fits
+import multiprocessing
+import numpy as np
+import emcee
+import cosmolib as cs
+
+PARAMETERS = ['omega_M_0', 'omega_lambda_0', 'w0']
+
+TRUE_COSMO = {'omega_M_0': 0.3, 'omega_lambda_0': 0.7, 'w0': -1, 'h': 0.7}
+
+
+# -------------------- Mock catalogs --------------------
+def mock_catalogs(nmock, nsn, cosmo=TRUE_COSMO, zdist=None, zmin=0.01, zmax=1.0, sigma=0.15, sigma_int=0.12,
+                  offset=0., seed=42):
+    """
+    Generates nmock catalogs of nsn supernovae from musn1a.
+
+    Args:
+        nmock (int): number of catalogs.
+        nsn (int): supernovae per catalog.
+        cosmo (dict): true cosmology.
+        zdist (function): zdist(rng, size) drawing redshifts, uniform in [zmin, zmax] if None.
+        sigma (float or function): measurement error, or sigma(z) as an array function.
+        sigma_int (float): intrinsic scatter added to the scatter of the data (not to the quoted errors).
+        offset (float): absolute magnitude offset added to all mu.
+        seed (int): random seed.
+
+    Returns:
+        z, mu, err: arrays of shape (nmock, nsn).
+    """
+    rng = np.random.default_rng(seed)
+    if zdist is None:
+        z = rng.uniform(zmin, zmax, size=(nmock, nsn))
+    else:
+        z = np.reshape(zdist(rng, nmock * nsn), (nmock, nsn))
+    z = np.sort(z, axis=1)
+    err = sigma(z) if callable(sigma) else np.full(z.shape, float(sigma))
+    ### one distance integration for all catalogs
+    mu = cs.musn1a(z.ravel(), cosmo).reshape(z.shape) + offset
+    mu += rng.normal(0, 1, z.shape) * np.sqrt(err**2 + sigma_int**2)
+    return z, mu, err
+
+
+# -------------------- Fit of one mock --------------------
+def fit_mock(args):
+    """
+    Fits one catalog with musn1a_shape (offset marginalized, sigma_int known).
+
+    Returns:
+        values, errors (for the free parameters), 16/84 and 2.5/97.5 percentiles (mcmc only) and validity.
+    """
+    z, mu, err, sigma_int, guess, fixpars, method, nbmc, seed = args
+    data = cs.Data(z, mu, np.sqrt(err**2 + sigma_int**2), cs.musn1a_shape, marg_offset=True)
+    free = [k for k in range(len(guess)) if k not in fixpars]
+    try:
+        m, ch2, ndf = data.fit_minuit(np.array(guess, dtype=float), fixpars=fixpars or None)
+    except Exception:
+        return None
+    values = np.array(m.values)[free]
+    errors = np.array(m.errors)[free]
+    valid = m.valid
+    percentiles = np.full((len(free), 4), np.nan)
+    if method == 'mcmc':
+        ### short chain started around the minuit fit
+        np.random.seed(seed)
+        p0 = np.array(m.values)
+        def logp(theta):
+            full = p0.copy()
+            full[free] = theta
+            return data(full)
+        nwalkers = 4 * len(free)
+        pos = values + 0.1 * errors * np.random.randn(nwalkers, len(free))
+        sampler = emcee.EnsembleSampler(nwalkers, len(free), logp)
+        state = sampler.run_mcmc(pos, nbmc // 3)
+        sampler.reset()
+        sampler.run_mcmc(state, nbmc)
+        chain = sampler.get_chain(flat=True)
+        values = np.median(chain, axis=0)
+        errors = np.std(chain, axis=0)
+        percentiles = np.percentile(chain, [16, 84, 2.5, 97.5], axis=0).T
+    return values, errors, percentiles, valid
+
+
+# -------------------- Validation --------------------
+def validate(nmock=1000, nsn=150, cosmo=TRUE_COSMO, fixpars=[2], method='minuit', nbmc=600, nproc=None,
+             verbose=True, **mock_args):
+    """
+    Fits nmock mock catalogs and measures bias, pulls and coverage of the fitted parameters.
+
+    Args:
+        nmock, nsn (int): number of catalogs and supernovae per catalog.
+        cosmo (dict): true cosmology (also the starting point of the fits).
+        fixpars (list): indices in PARAMETERS kept at their true value.
+        method (str): 'minuit' (errors from hesse) or 'mcmc' (short emcee chain per mock).
+        nbmc (int): chain length with method='mcmc'.
+        nproc (int): worker processes, all cores if None.
+        mock_args: passed to mock_catalogs (zdist, sigma, sigma_int, ...).
+
+    Returns:
+        dict: per free parameter: 'values', 'errors', 'pulls', 'bias', 'pull_mean', 'pull_std',
+        'coverage68', 'coverage95', plus 'nfailed' (only 'nfailed' if no fit is valid).
+    """
+    sigma_int = mock_args.get('sigma_int', 0.12)
+    z, mu, err = mock_catalogs(nmock, nsn, cosmo=cosmo, **mock_args)
+    truth = np.array([cosmo[p] for p in PARAMETERS], dtype=float)
+    free = [k for k in range(len(PARAMETERS)) if k not in fixpars]
+    tasks = [(z[i], mu[i], err[i], sigma_int, truth, list(fixpars), method, nbmc, i) for i in range(nmock)]
+    if nproc == 1:
+        results = list(map(fit_mock, tasks))
+    else:
+        with multiprocessing.Pool(nproc) as pool:
+            results = pool.map(fit_mock, tasks, chunksize=max(1, nmock // (8 * (nproc or multiprocessing.cpu_count()))))
+    ok = [r for r in results if r is not None and r[3]]
+    if not ok:
+        ### No statistics without a valid fit (no parameter entries in the report)
+        if verbose:
+            print(f"0/{nmock} valid fits ({method})")
+        return {'nfailed': nmock}
+
+    values = np.array([r[0] for r in ok])
+    errors = np.array([r[1] for r in ok])
+    percentiles = np.array([r[2] for r in ok])
+    report = {'nfailed': nmock - len(ok)}
+    for j, k in enumerate(free):
+        pulls = (values[:, j] - truth[k]) / errors[:, j]
+        if method == 'mcmc':
+            cov68 = np.mean((percentiles[:, j, 0] <= truth[k]) & (truth[k] <= percentiles[:, j, 1]))
+            cov95 = np.mean((percentiles[:, j, 2] <= truth[k]) & (truth[k] <= percentiles[:, j, 3]))
+        else:
+            cov68 = np.mean(np.abs(pulls) < 1)
+            cov95 = np.mean(np.abs(pulls) < 1.96)
+        report[PARAMETERS[k]] = {
+            'values': values[:, j], 'errors': errors[:, j], 'pulls': pulls,
+            'bias': np.mean(values[:, j]) - truth[k],
+            'bias_err': np.std(values[:, j]) / np.sqrt(len(ok)),
+            'pull_mean': np.mean(pulls), 'pull_std': np.std(pulls),
+            'coverage68': cov68, 'coverage95': cov95,
+        }
+    if verbose:
+        print(f"{len(ok)}/{nmock} valid fits ({method})")
+        for k in free:
+            r = report[PARAMETERS[k]]
+            print(f"{PARAMETERS[k]}: bias = {r['bias']:.4f} ± {r['bias_err']:.4f}, "
+                  f"pull = {r['pull_mean']:.2f} ± {r['pull_std']:.2f}, "
+                  f"coverage 68% = {r['coverage68']:.3f}, 95% = {r['coverage95']:.3f}")
+    return report
+
+
+def plot_pulls(report, nbins=40):
+    import matplotlib.pyplot as plt
+    names = [p for p in PARAMETERS if p in report]
+    x = np.linspace(-4, 4, 200)
+    for i, name in enumerate(names):
+        plt.subplot(1, len(names), i + 1)
+        plt.hist(report[name]['pulls'], bins=nbins, range=(-4, 4), density=True, alpha=0.6)
+        plt.plot(x, np.exp(-0.5 * x**2) / np.sqrt(2 * np.pi), 'k')
+        plt.xlabel(f'pull {name}')
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == "__main__":
+    report = validate(nmock=1000, nsn=150)
+    plot_pulls(report)
@@ -0,0 +1,253 @@
+"""
+Benchmarks of the SN / cosmology library and of the CMB time-domain hot paths.
+
+Every benchmark builds reproducible synthetic inputs (fixed seeds) for each size of its
+parameter list and times one callable. Results (best time per call and peak traced memory)
+are appended to a JSON-lines file with the git commit, so that runs of different commits
+can be compared:
+
+    python benchmarks/bench.py                  # all benchmarks
+    python benchmarks/bench.py -k propdist -q   # subset, smallest sizes only
+    python benchmarks/bench.py --compare abc123 def456
+"""
+import os
+import re
+import sys
+import ast
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'SN3+CMB3'))
+sys.path.insert(0, os.path.join(ROOT, 'CMB1'))
+
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+
+BENCHMARKS = []
+
+
+def benchmark(name, sizes):
+    """Registers setup(size) -> callable as a benchmark run for each size."""
+    def register(setup):
+        BENCHMARKS.append((name, sizes, setup))
+        return setup
+    return register
+
+
+def load_function(path, name):
+    """Function name defined in the script path, without running the rest of the script."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    module = ast.Module(body=[node for node in tree.body
+                              if isinstance(node, (ast.Import, ast.ImportFrom))
+                              or (isinstance(node, ast.FunctionDef) and node.name == name)], type_ignores=[])
+    namespace = {}
+    exec(compile(module, path, 'exec'), namespace)
+    return namespace[name]
+
+
+# -------------------- Cosmology --------------------
+COSMO = {'omega_M_0': 0.3, 'omega_lambda_0': 0.7, 'w0': -1., 'h': 0.7}
+
+
+@benchmark('propdist', sizes=[('scalar', 1.), ('array', 1.), ('scalar', 1090.), ('array', 1090.)])
+def bench_propdist(size):
+    import cosmolib as cs
+    kind, zmax = size
+    z = zmax if kind == 'scalar' else np.linspace(zmax / 1000, zmax, 1000)
+    return lambda: cs.propdist(z, COSMO)
+
+
+@benchmark('musn1a', sizes=[150, 1000, 10000])
+def bench_musn1a(n):
+    import cosmolib as cs
+    z = np.random.default_rng(0).uniform(0.01, 1.5, n)
+    return lambda: cs.musn1a(z, COSMO)
+
+
+def _sn_data(n, full):
+    import cosmolib as cs
+    rng = np.random.default_rng(1)
+    z = np.sort(rng.uniform(0.01, 1.5, n))
+    err = np.full(n, 0.15)
+    mu = cs.musn1a_shape(z, [0.3, 0.7, -1]) + err * rng.standard_normal(n)
+    if full:
+        ### diagonal + small correlated part
+        cov = np.diag(err**2) + 0.01**2 * np.exp(-np.abs(z[:, None] - z[None, :]) / 0.1)
+        return cs.Data(z, mu, cov, cs.musn1a_shape)
+    return cs.Data(z, mu, err, cs.musn1a_shape)
+
+
+@benchmark('Data.__call__', sizes=[('diag', 100), ('diag', 1000), ('diag', 10000),
+                                   ('full', 100), ('full', 1000), ('full', 10000)])
+def bench_data_call(size):
+    kind, n = size
+    data = _sn_data(n, kind == 'full')
+    return lambda: data([0.3, 0.7, -1.])
+
+
+@benchmark('fit_minuit', sizes=[150, 1000])
+def bench_fit_minuit(n):
+    data = _sn_data(n, False)
+    return lambda: data.fit_minuit(np.array([0.3, 0.7, -1.]), fixpars=[2])
+
+
+# -------------------- Light curves --------------------
+def _synthetic_template():
+    t = np.linspace(-20, 80, 201)
+    flux = np.exp(-0.5 * (t / 10)**2) * (t < 0) + (t >= 0) * (0.75 * np.exp(-t / 20) + 0.25 * np.exp(-0.5 * (t / 10)**2))
+    return np.array([t, -2.5 * np.log10(flux + 0.02)])
+
+
+@benchmark('fit_supernova_lightcurve', sizes=[20, 100])
+def bench_lightcurve(nlc):
+    from lightcurve import SplineLightCurve, fit_supernova_lightcurve
+    template = SplineLightCurve(_synthetic_template())
+    rng = np.random.default_rng(2)
+    light_curves = []
+    for i in range(nlc):
+        z = rng.uniform(0.05, 1.)
+        t = np.sort(rng.uniform(-15, 70, 40)) * (1 + z)
+        mag = template(t / (1 + z), [rng.uniform(-3, 3), rng.uniform(0.8, 1.2), 40 + 5 * np.log10(z)])
+        err = np.full(len(t), 0.05)
+        light_curves.append((z, (t, mag + err * rng.standard_normal(len(t)), err)))
+    def run():
+        for i, (z, lc) in enumerate(light_curves):
+            fit_supernova_lightcurve(i, z, template, 0.12, lc_data=lc)
+    return run
+
+
+# -------------------- CMB time-ordered data --------------------
+def _synthetic_pointing(nsamples, fs=1000., fknee=1.):
+    rng = np.random.default_rng(3)
+    ### slow scan around the galactic center, white + 1/f noise TOD (power a + b/f)
+    t = np.arange(nsamples)
+    l = (10 * np.sin(2 * np.pi * t / 20000) + 0.01 * rng.standard_normal(nsamples)) % 360
+    b = 5 * np.sin(2 * np.pi * t / 3100) + 0.01 * rng.standard_normal(nsamples)
+    freqs = np.fft.rfftfreq(nsamples, d=1 / fs)
+    freqs[0] = freqs[1]
+    tod = np.fft.irfft(np.fft.rfft(rng.standard_normal(nsamples)) * np.sqrt(1 + fknee / freqs), n=nsamples)
+    return l, b, tod
+
+
+def bin_tod_loop(l, b, tod, nside=128):
+    """HEALPix binning as written in CMB1/Combined maps (final).py."""
+    import healpy as hp
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    npix = hp.nside2npix(nside)
+    combined_map = np.zeros(npix)
+    hit_count = np.zeros(npix)
+    sky_coords = SkyCoord(l=l * u.deg, b=b * u.deg, frame="galactic")
+    theta = np.pi / 2 - sky_coords.b.radian
+    phi = sky_coords.l.radian
+    pixel_indices = hp.ang2pix(nside, theta, phi)
+    for i, pix in enumerate(pixel_indices):
+        combined_map[pix] += tod[i]
+        hit_count[pix] += 1
+    return combined_map, hit_count
+
+
+@benchmark('healpix_binning_loop', sizes=[10**4, 10**5, 10**6])
+def bench_binning(nsamples):
+    l, b, tod = _synthetic_pointing(nsamples)
+    ### first SkyCoord call initializes astropy (not part of the binning cost)
+    bin_tod_loop(l[:10], b[:10], tod[:10])
+    return lambda: bin_tod_loop(l, b, tod)
+
+
+@benchmark('healpix_binning', sizes=[10**4, 10**5, 10**6])
+def bench_binning_vectorized(nsamples):
+    from mapmaking import make_map
+    l, b, tod = _synthetic_pointing(nsamples)
+    return lambda: make_map(l, b, tod, nside=128)
+
+
+@benchmark('prewhitening', sizes=[10**5, 10**6, 2**20])
+def bench_prewhitening(nsamples):
+    robust_quotient_tod = load_function(os.path.join(ROOT, 'CMB1', 'Prewhitening', 'Prewhitening.py'),
+                                        'robust_quotient_tod')
+    _, _, tod = _synthetic_pointing(nsamples)
+    return lambda: robust_quotient_tod(tod)
+
+
+# -------------------- Runner --------------------
+def measure(func, min_time=0.2, max_repeat=1000):
+    """
+    Best time per call over repeated calls (at least min_time in total), then peak traced
+    memory of one more call (tracemalloc slows down the code, so it is not timed).
+    """
+    times = []
+    total = 0.
+    while total < min_time and len(times) < max_repeat:
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        total += times[-1]
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), len(times), peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(pattern=None, quick=False, results_file=RESULTS_FILE, verbose=True):
+    """Runs the benchmarks whose name matches pattern and appends the results to results_file."""
+    context = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.node()}
+    records = []
+    for name, sizes, setup in BENCHMARKS:
+        if pattern is not None and not re.search(pattern, name):
+            continue
+        for size in (sizes[:1] if quick else sizes):
+            func = setup(size)
+            best, repeat, peak = measure(func)
+            record = dict(context, name=name, size=size, time=best, repeat=repeat, peak_mem=peak)
+            records.append(record)
+            if verbose:
+                print(f"{name:26s} {str(size):16s} {best*1e3:10.3f} ms  ({repeat:4d} runs)  peak {peak/2**20:8.2f} MiB")
+    with open(results_file, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return records
+
+
+def compare(commit_a, commit_b, results_file=RESULTS_FILE):
+    """Time ratios b / a of the benchmarks run for both commits (last run of each)."""
+    latest = {}
+    with open(results_file) as f:
+        for line in f:
+            r = json.loads(line)
+            latest[(r['commit'], r['name'], json.dumps(r['size']))] = r
+    for (commit, name, size), ra in sorted(latest.items()):
+        if commit != commit_a or (commit_b, name, size) not in latest:
+            continue
+        rb = latest[(commit_b, name, size)]
+        print(f"{name:26s} {size:16s} {ra['time']*1e3:10.3f} -> {rb['time']*1e3:10.3f} ms  x{rb['time']/ra['time']:6.2f}"
+              f"   mem {ra['peak_mem']/2**20:8.2f} -> {rb['peak_mem']/2**20:8.2f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the cosmology and CMB hot paths')
+    parser.add_argument('-k', dest='pattern', help='run only the benchmarks matching this regular expression')
+    parser.add_argument('-q', '--quick', action='store_true', help='smallest size of each benchmark only')
+    parser.add_argument('-o', '--output', default=RESULTS_FILE, help='results file (JSON lines)')
+    parser.add_argument('--compare', nargs=2, metavar=('COMMIT_A', 'COMMIT_B'), help='compare two recorded commits')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare, results_file=args.output)
+    else:
+        run(args.pattern, quick=args.quick, results_file=args.output)